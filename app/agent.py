@@ -1,8 +1,26 @@
 from enum import Enum
+import asyncio
 import time
+from typing import Awaitable, Callable, Iterable, Optional
+from .config import (
+    CHUNK_SIZE_CHARS,
+    MAX_PROMPT_TOKENS,
+    SPECULATIVE_GENERATE_MAX_TOKENS,
+    SUMMARY_TOKEN_THRESHOLD,
+)
+from .utils import (
+    chunk_hash,
+    split_text_content_defined,
+    split_text_by_tokens,
+    distribute_count,
+    estimate_tokens,
+)
+from .dedup import NearDuplicateIndex, question_signature
+from .metrics import STAGE_DURATION
 from .tools import (
-    call_gemini_summarize,
+    call_gemini_summarize_hierarchical,
     call_gemini_generate_mcqs,
+    contains_failed_generation,
     evaluate_mcq,
 )
 
@@ -10,68 +28,319 @@ class SummaryMode(str, Enum):
     AUTO = "auto"
     FORCE = "force"
     NONE = "none"
+    CHUNKED = "chunked"
 
 class Agent:
-    def decide_and_run(
+    async def decide_and_run(
         self,
         text: str,
         num_questions: int = 5,
         summary_mode: str = SummaryMode.AUTO,
-        is_summary: bool = False
+        is_summary: bool = False,
+        on_event: Optional[Callable[[str, dict], Awaitable[None]]] = None,
+        existing_questions: Optional[Iterable[dict]] = None,
+        previous: Optional[dict] = None,
     ):
         """
         Pipeline process:
         - If is_summary=True → text is already summarized, only generate MCQs.
         - If summary_mode="force" → always summarize.
         - If summary_mode="none" → no summarize.
-        - If summary_mode="auto" → summarize if text length > 3000 chars.
+        - If summary_mode="auto" → summarize if text > SUMMARY_TOKEN_THRESHOLD tokens (estimated);
+          up to SPECULATIVE_GENERATE_MAX_TOKENS, questions are generated on the raw chunks first and
+          the summary is only produced if that fails (see _run_chunked_with_summary_fallback).
+        - If summary_mode="chunked" → map-reduce: generate on overlapping chunks concurrently.
+
+        Mỗi nguồn văn bản chạy như một đồ thị nhỏ: sinh câu hỏi → đánh giá ngay khi
+        nguồn đó sinh xong, các nguồn chạy song song với nhau (và với bước tóm tắt).
+
+        `on_event(event, data)` (tùy chọn) nhận tiến trình để stream cho client:
+        "stage" (bắt đầu/xong từng bước), "summary" và "question" (từng câu đã chấm).
+
+        Không prompt nào vượt MAX_PROMPT_TOKENS: văn bản dài được tóm tắt phân cấp,
+        hoặc (summary_mode="none") sinh câu hỏi theo từng phần.
+
+        Câu hỏi gần trùng (câu dẫn + lựa chọn, với nhau hoặc với `existing_questions` — các câu
+        {"question", "options"} user đã lưu cho cùng file) bị loại trước khi đánh giá;
+        số câu bị loại trả về ở "duplicates_dropped".
+
+        `previous` (tài liệu sửa lại từ một file đã lưu): {"summary", "chunks": {chunk_hash: câu hỏi
+        đã lưu}} → chạy incremental, chỉ sinh câu hỏi cho các chunk mới / đã sửa.
         """
+        events = _Events(on_event, existing_questions)
+
+        if previous and not is_summary:
+            return await self._run_incremental(text, num_questions, previous, events, summary_mode)
 
         # Input already summary (From audio transcript)
         if is_summary:
-            mcqs = timed_step("Sinh câu hỏi", call_gemini_generate_mcqs, text, num_questions)
-            return {"mode": "mcqs", "questions": mcqs}
+            mcqs = await events.step("generate", call_gemini_generate_mcqs, text, num_questions)
+            mcqs = events.drop_duplicates(mcqs)
+            for q in mcqs:
+                await events.question(q)
+            return {"mode": "mcqs", "questions": mcqs, "duplicates_dropped": events.duplicates_dropped}
 
         # Always summarize
         if summary_mode == SummaryMode.FORCE:
-            summary = timed_step("Tóm tắt", call_gemini_summarize, text)
-            mcqs = timed_step(
-                "Sinh câu hỏi", call_gemini_generate_mcqs, summary, num_questions
-            )
-            evaluated = timed_step("Đánh giá", evaluate_mcq, mcqs, summary)
+            summary = await events.step("summarize", call_gemini_summarize_hierarchical, text)
+            await events.emit("summary", {"summary": summary})
+            sources = split_text_by_tokens(summary, MAX_PROMPT_TOKENS)
+            questions = await self._generate_and_evaluate(sources, num_questions, events)
             return {
                 "mode": "summary+mcqs",
                 "summary": summary,
-                "questions": evaluated,
+                "questions": questions,
+                "duplicates_dropped": events.duplicates_dropped,
             }
 
-        # No summarize
-        if summary_mode == SummaryMode.NONE:
-            mcqs = timed_step("Sinh câu hỏi", call_gemini_generate_mcqs, text, num_questions)
-            evaluated = timed_step("Đánh giá", evaluate_mcq, mcqs, text)
-            return {"mode": "mcqs", "questions": evaluated}
-
-        # Summarize if text length > 3000 chars.
-        if len(text) > 3000:
-            summary = timed_step("Tóm tắt", call_gemini_summarize, text)
-            mcqs = timed_step(
-                "Sinh câu hỏi", call_gemini_generate_mcqs, summary, num_questions
+        # Map-reduce over chunks
+        if summary_mode == SummaryMode.CHUNKED:
+            chunks = split_text_content_defined(text, CHUNK_SIZE_CHARS)
+            questions = await self._generate_and_evaluate(
+                chunks, num_questions, events, tags=[chunk_hash(c) for c in chunks]
             )
-            evaluated = timed_step("Đánh giá", evaluate_mcq, mcqs, summary)
             return {
-                "mode": "summary+mcqs",
-                "summary": summary,
-                "questions": evaluated,
+                "mode": "chunked+mcqs",
+                "chunks": len(chunks),
+                "questions": questions,
+                "duplicates_dropped": events.duplicates_dropped,
             }
 
+        # No summarize
+        if summary_mode == SummaryMode.NONE:
+            sources = split_text_by_tokens(text, MAX_PROMPT_TOKENS)
+            questions = await self._generate_and_evaluate(sources, num_questions, events)
+            return {"mode": "mcqs", "questions": questions, "duplicates_dropped": events.duplicates_dropped}
+
+        # Summarize if text is longer than SUMMARY_TOKEN_THRESHOLD tokens.
+        if estimate_tokens(text) > SUMMARY_TOKEN_THRESHOLD:
+            return await self._run_chunked_with_summary_fallback(text, num_questions, events)
+
         # Default: Short text > summarize
-        mcqs = timed_step("Sinh câu hỏi", call_gemini_generate_mcqs, text, num_questions)
-        evaluated = timed_step("Đánh giá", evaluate_mcq, mcqs, text)
-        return {"mode": "mcqs", "questions": evaluated}
-
-def timed_step(label, func, *args, **kwargs):
-    start = time.time()
-    print(f"⏱️  Bắt đầu {label}...")
-    result = func(*args, **kwargs)
-    print(f"✅ {label} xong trong {time.time() - start:.2f}s\n")
-    return result
\ No newline at end of file
+        questions = await self._generate_and_evaluate([text], num_questions, events)
+        return {"mode": "mcqs", "questions": questions, "duplicates_dropped": events.duplicates_dropped}
+
+    async def _run_chunked_with_summary_fallback(self, text: str, num_questions: int, events: "_Events"):
+        """
+        AUTO với văn bản dài (tới SPECULATIVE_GENERATE_MAX_TOKENS): sinh câu hỏi trên văn bản gốc
+        chia chunk trước. Có câu hỏi dùng được (hoặc mọi câu bị loại vì trùng) → mode
+        "chunked+mcqs", KHÔNG tóm tắt và không có "summary". Ngược lại (hoặc văn bản dài hơn
+        ngưỡng trên) mới tóm tắt rồi sinh từ bản tóm tắt → mode "summary+mcqs" có "summary".
+        Hình dạng kết quả chỉ phụ thuộc vào kết quả sinh, không phụ thuộc thứ tự hoàn thành,
+        và không request nào trả tiền cho cả hai đường.
+        """
+        if estimate_tokens(text) <= SPECULATIVE_GENERATE_MAX_TOKENS:
+            chunks = split_text_content_defined(text, CHUNK_SIZE_CHARS)
+            questions = await self._generate_and_evaluate(
+                chunks, num_questions, events, tags=[chunk_hash(c) for c in chunks]
+            )
+            if (questions or events.duplicates_dropped) and not contains_failed_generation(questions):
+                return {
+                    "mode": "chunked+mcqs",
+                    "chunks": len(chunks),
+                    "questions": questions,
+                    "duplicates_dropped": events.duplicates_dropped,
+                }
+            print("⚠️  Sinh câu hỏi trên văn bản gốc thất bại, sinh lại từ bản tóm tắt.")
+
+        summary = await events.step("summarize", call_gemini_summarize_hierarchical, text)
+        await events.emit("summary", {"summary": summary})
+        sources = split_text_by_tokens(summary, MAX_PROMPT_TOKENS)
+        questions = await self._generate_and_evaluate(sources, num_questions, events)
+
+        return {
+            "mode": "summary+mcqs",
+            "summary": summary,
+            "questions": questions,
+            "duplicates_dropped": events.duplicates_dropped,
+        }
+
+    async def _run_incremental(
+        self, text: str, num_questions: int, previous: dict, events: "_Events", summary_mode: str
+    ):
+        """
+        Tài liệu re-upload sau khi sửa: chia chunk theo nội dung (cùng cách với lần trước),
+        mỗi chunk nhận phần câu hỏi như khi chạy đầy đủ (distribute_count). Chunk đã có trong bản
+        trước dùng lại tối đa phần đó từ câu hỏi đã lưu và chỉ sinh thêm phần còn thiếu; chunk
+        mới / đã sửa được sinh + đánh giá toàn bộ phần của nó.
+        Tóm tắt theo `summary_mode` như khi chạy đầy đủ (force, hoặc auto với văn bản dài):
+        nếu chunk có thay đổi thì tóm tắt lại (song song với bước sinh câu hỏi), không đổi thì
+        giữ bản cũ; các mode không tóm tắt trả về "summary" None.
+        """
+        chunks = split_text_content_defined(text, CHUNK_SIZE_CHARS)
+        counts = distribute_count(num_questions, len(chunks))
+        saved = previous.get("chunks") or {}
+
+        reused, sources, source_counts, tags = [], [], [], []
+        changed_chunks = 0
+        for chunk, count in zip(chunks, counts):
+            h = chunk_hash(chunk)
+            if h in saved:
+                kept = saved[h][:count]
+                reused.extend(kept)
+                count -= len(kept)
+            else:
+                changed_chunks += 1
+            if count > 0:
+                sources.append(chunk)
+                source_counts.append(count)
+                tags.append(h)
+
+        await events.emit("stage", {
+            "stage": "reuse", "status": "done", "chunks": len(chunks), "changed_chunks": changed_chunks,
+        })
+        for q in reused:
+            await events.question(q)
+
+        summary = None
+        summary_task = None
+        if summary_mode == SummaryMode.FORCE or (
+            summary_mode == SummaryMode.AUTO and estimate_tokens(text) > SUMMARY_TOKEN_THRESHOLD
+        ):
+            summary = previous.get("summary")
+            changed = bool(changed_chunks) or set(saved) != {chunk_hash(c) for c in chunks}
+            if changed or not summary:
+                async def summarize():
+                    new_summary = await events.step("summarize", call_gemini_summarize_hierarchical, text)
+                    await events.emit("summary", {"summary": new_summary})
+                    return new_summary
+
+                summary_task = asyncio.ensure_future(summarize())
+
+        try:
+            questions = await self._generate_and_evaluate(
+                sources, num_questions, events, counts=source_counts, tags=tags
+            ) if sources else []
+            if summary_task is not None:
+                summary = await summary_task
+        except BaseException:
+            if summary_task is not None:
+                summary_task.cancel()
+            raise
+
+        return {
+            "mode": "incremental",
+            "summary": summary,
+            "chunks": len(chunks),
+            "changed_chunks": changed_chunks,
+            "reused_questions": len(reused),
+            "questions": reused + questions,
+            "duplicates_dropped": events.duplicates_dropped,
+        }
+
+    async def _generate_and_evaluate(
+        self,
+        sources: list,
+        num_questions: int,
+        events: "_Events",
+        counts: Optional[list] = None,
+        tags: Optional[list] = None,
+    ) -> list:
+        """
+        Chia số câu hỏi cho các nguồn văn bản (hoặc dùng sẵn `counts`); với mỗi nguồn: sinh
+        câu hỏi rồi đánh giá ngay (context = chính nguồn đó) mà không chờ các nguồn khác.
+        Câu hỏi gần trùng (giữa các nguồn do phần chồng lấn, hoặc với câu đã có) bị loại
+        ngay khi nguồn sinh xong. Nguồn sinh thất bại bị bỏ qua (placeholder lỗi không được chấm
+        hay stream cho client); chỉ khi MỌI nguồn đều lỗi mới trả về placeholder.
+        `tags` (chunk_hash của từng nguồn) được gắn vào câu hỏi ở "_chunk_hash" để lần
+        re-upload sau dùng lại được.
+        """
+        if counts is None:
+            counts = distribute_count(num_questions, len(sources))
+        tags = tags or [None] * len(sources)
+        jobs = [(source, count, tag) for source, count, tag in zip(sources, counts, tags) if count > 0]
+        failures = []
+
+        async def run_source(index: int, source: str, count: int, tag: Optional[str]):
+            chunk = {"chunk": index + 1, "chunks": len(jobs)} if len(jobs) > 1 else {}
+            mcqs = await events.step("generate", call_gemini_generate_mcqs, source, count, **chunk)
+            if contains_failed_generation(mcqs):
+                # Câu hỏi lỗi (placeholder): không chấm, không trộn vào kết quả của các nguồn khác
+                failures.append(mcqs)
+                return []
+
+            kept = events.drop_duplicates(mcqs)
+            if not kept:
+                return []
+
+            # Gắn tag sau khi chấm (không đưa vào prompt đánh giá / khóa cache)
+            async def on_result(q):
+                if tag:
+                    q["_chunk_hash"] = tag
+                await events.question(q)
+
+            return await events.step("evaluate", evaluate_mcq, kept, source, on_result=on_result, **chunk)
+
+        results = await asyncio.gather(
+            *(run_source(i, source, count, tag) for i, (source, count, tag) in enumerate(jobs))
+        )
+        questions = []
+        for result in results:
+            if isinstance(result, list):
+                questions.extend(result)
+            else:
+                questions.append(result)
+        if failures and len(failures) == len(jobs):
+            # Mọi nguồn đều sinh lỗi: trả placeholder (chưa chấm) để caller nhận biết
+            return failures[0]
+        return questions
+
+class _Events:
+    """Gửi sự kiện tiến trình tới `on_event`; không làm gì nếu không có callback."""
+
+    def __init__(self, on_event, existing_questions=None):
+        self.on_event = on_event
+        self.question_count = 0
+        self.duplicates_dropped = 0
+        self.dedup = NearDuplicateIndex()
+        for question in existing_questions or ():
+            self.dedup.add(question_signature(question))
+
+    async def emit(self, event: str, data: dict):
+        if self.on_event is not None:
+            await self.on_event(event, data)
+
+    async def step(self, stage: str, func, *args, on_result=None, **extra):
+        """timed_step + sự kiện "stage" lúc bắt đầu / kết thúc."""
+        await self.emit("stage", {"stage": stage, "status": "started", **extra})
+        if on_result is not None:
+            result = await timed_step(stage, func, *args, on_result=on_result)
+        else:
+            result = await timed_step(stage, func, *args)
+        await self.emit("stage", {"stage": stage, "status": "done", **extra})
+        return result
+
+    def drop_duplicates(self, mcqs) -> list:
+        """
+        Bỏ câu hỏi gần trùng với các câu đã thấy trong request (hoặc đã lưu trước đó).
+        Các nguồn cùng chạy trên một event loop nên cập nhật index không cần lock.
+        Kết quả sinh thất bại được giữ nguyên, không đưa vào index.
+        """
+        if not isinstance(mcqs, list):
+            return []
+        if contains_failed_generation(mcqs):
+            return [q for q in mcqs if isinstance(q, dict)]
+        kept = []
+        for q in mcqs:
+            if not isinstance(q, dict):
+                continue
+            if self.dedup.add_if_new(question_signature(q)):
+                kept.append(q)
+            else:
+                self.duplicates_dropped += 1
+        return kept
+
+    async def question(self, q: dict):
+        self.question_count += 1
+        await self.emit("question", {"index": self.question_count, "question": q})
+
+async def timed_step(stage, func, *args, **kwargs):
+    """Chạy một bước của pipeline và ghi thời gian vào mcq_stage_duration_seconds{stage}."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await func(*args, **kwargs)
+        outcome = "success"
+        return result
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage, outcome=outcome)
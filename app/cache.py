@@ -0,0 +1,271 @@
+"""Cache kết quả LLM.
+
+- DiskCache: cache trên đĩa (SQLite), dùng chung giữa các worker uvicorn.
+  Key = hash(stage, model, phiên bản prompt, nội dung) nên đổi model hoặc sửa prompt
+  sẽ tự động bỏ qua các entry cũ. Entry hết hạn theo TTL, và khi tổng dung lượng vượt
+  giới hạn thì các entry ít được dùng gần đây nhất bị xóa trước.
+- LRUCache: cache trong RAM có giới hạn theo byte, dùng làm tầng nhanh phía trước DiskCache.
+- CountCache: cache số đếm (COUNT) trong RAM theo (scope, key) với TTL, xóa theo scope.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from .config import (
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_PATH,
+    LLM_CACHE_TTL_SECONDS,
+    LLM_CACHE_MAX_MB,
+    QUESTION_COUNT_CACHE_ENTRIES,
+    QUESTION_COUNT_CACHE_SECONDS,
+)
+from .metrics import CACHE_REQUESTS
+
+def make_cache_key(stage: str, model_name: str, prompt_version: str, *parts: Any) -> str:
+    """Content-addressed key: sha256 của stage/model/prompt version và các phần nội dung."""
+    h = hashlib.sha256()
+    for part in (stage, model_name, prompt_version, *parts):
+        if not isinstance(part, (str, bytes)):
+            part = json.dumps(part, ensure_ascii=False, sort_keys=True)
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return f"{stage}:{h.hexdigest()}"
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """sha256 của một file, đọc theo từng khối để không nạp cả file vào RAM."""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+_MISSING = object()
+
+class LRUCache:
+    """LRU trong RAM, giới hạn theo tổng số byte (ước lượng bằng kích thước JSON của value)."""
+
+    def __init__(self, max_bytes: int, stage: str = ""):
+        self.max_bytes = max_bytes
+        self.stage = stage  # label "stage" của metrics mcq_cache_requests_total
+        self._data = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="memory", stage=self.stage, result="miss")
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+        CACHE_REQUESTS.inc(cache="memory", stage=self.stage, result="hit")
+        return entry[0]
+
+    def set(self, key: str, value: Any) -> None:
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8")) + len(key)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+class CountCache:
+    """
+    Số đếm theo (scope, key) — ví dụ (user_id, bộ lọc) — sống tối đa `ttl_seconds`.
+    invalidate(scope) làm mọi entry của scope hết hiệu lực ngay (tăng "thế hệ" của scope).
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int, stage: str = ""):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.stage = stage
+        self._data = OrderedDict()  # (scope, key) -> (value, expires_at, generation)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, scope: Any, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get((scope, key))
+            if entry is not None and (entry[1] < now or entry[2] != self._generations.get(scope, 0)):
+                del self._data[(scope, key)]
+                entry = None
+            if entry is not None:
+                self._data.move_to_end((scope, key))
+        CACHE_REQUESTS.inc(cache="memory", stage=self.stage, result="miss" if entry is None else "hit")
+        return None if entry is None else entry[0]
+
+    def set(self, scope: Any, key: str, value: int) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._data[(scope, key)] = (value, time.monotonic() + self.ttl_seconds, self._generations.get(scope, 0))
+            self._data.move_to_end((scope, key))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, scope: Any) -> None:
+        with self._lock:
+            self._generations[scope] = self._generations.get(scope, 0) + 1
+
+class DiskCache:
+    """Key/value store JSON trên SQLite với TTL và giới hạn dung lượng."""
+
+    # Chỉ ghi lại accessed_at nếu lần truy cập trước đã cũ hơn ngưỡng này (giảm số lần ghi)
+    TOUCH_INTERVAL = 60
+    # Dọn TTL / dung lượng sau mỗi N lần ghi thay vì mọi lần ghi
+    EVICT_EVERY = 20
+
+    def __init__(self, path: str, ttl_seconds: int, max_bytes: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._writes = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            with self._init_lock:
+                if not self._initialized:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS llm_cache (
+                            key TEXT PRIMARY KEY,
+                            value TEXT NOT NULL,
+                            size INTEGER NOT NULL,
+                            created_at REAL NOT NULL,
+                            accessed_at REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, created_at, accessed_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        value, created_at, accessed_at = row
+        if self.ttl_seconds and created_at + self.ttl_seconds < now:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return default
+        if now - accessed_at > self.TOUCH_INTERVAL:
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        if self.max_bytes and size > self.max_bytes:
+            return
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, payload, size, now, now),
+        )
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 1:
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.ttl_seconds:
+            conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        if not self.max_bytes:
+            return
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Xóa các entry lâu không dùng nhất cho tới khi xuống dưới 90% giới hạn
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at ASC"):
+            if total - freed <= target:
+                break
+            stale.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale)
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        """Như get() nhưng chạy trong thread để không chặn event loop."""
+        if not LLM_CACHE_ENABLED:
+            return default
+        stage = key.split(":", 1)[0]
+        try:
+            value = await asyncio.to_thread(self.get, key, _MISSING)
+        except sqlite3.Error as e:
+            print(f"⚠️  Lỗi đọc LLM cache: {e}")
+            CACHE_REQUESTS.inc(cache="disk", stage=stage, result="error")
+            return default
+        if value is _MISSING:
+            CACHE_REQUESTS.inc(cache="disk", stage=stage, result="miss")
+            return default
+        CACHE_REQUESTS.inc(cache="disk", stage=stage, result="hit")
+        return value
+
+    async def aset(self, key: str, value: Any) -> None:
+        if not LLM_CACHE_ENABLED:
+            return
+        try:
+            await asyncio.to_thread(self.set, key, value)
+        except sqlite3.Error as e:
+            print(f"⚠️  Lỗi ghi LLM cache: {e}")
+
+llm_cache = DiskCache(LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_MB * 1024 * 1024)
+# total_count của GET /questions theo (user_id, bộ lọc)
+question_counts = CountCache(QUESTION_COUNT_CACHE_SECONDS, QUESTION_COUNT_CACHE_ENTRIES, stage="question_count")
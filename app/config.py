@@ -10,6 +10,78 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 # Max upload file size in MB (default: 20)
 MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB"))
 
+# Max audio upload size in MB (default: same as MAX_FILE_SIZE_MB)
+MAX_AUDIO_FILE_SIZE_MB = int(os.getenv("MAX_AUDIO_FILE_SIZE_MB", MAX_FILE_SIZE_MB))
+
+# LLM backend: "gemini" (default) or "fake" (offline, deterministic; for benchmarks / load tests)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", 0))
+FAKE_LLM_FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", 0))
+FAKE_LLM_MALFORMED_RATE = float(os.getenv("FAKE_LLM_MALFORMED_RATE", 0))
+FAKE_LLM_OUTPUT_WORDS = int(os.getenv("FAKE_LLM_OUTPUT_WORDS", 200))
+FAKE_LLM_SEED = int(os.getenv("FAKE_LLM_SEED", 0))
+
+# Max number of in-flight Gemini requests per worker process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+# Extra calls allowed to fill in items missing from malformed JSON output (only the missing items)
+LLM_PARSE_RETRIES = int(os.getenv("LLM_PARSE_RETRIES", 1))
+
+# Chunked generation (SummaryMode.CHUNKED, AUTO on long texts, incremental re-upload):
+# target chunk size in characters; boundaries are content-defined (see split_text_content_defined)
+CHUNK_SIZE_CHARS = int(os.getenv("CHUNK_SIZE_CHARS", 6000))
+
+# AUTO mode: summarize texts estimated above this many tokens
+SUMMARY_TOKEN_THRESHOLD = int(os.getenv("SUMMARY_TOKEN_THRESHOLD", 1000))
+# Max estimated tokens of text sent in a single prompt; larger texts are summarized
+# hierarchically (chunks in parallel, then the summaries) or generated per chunk
+MAX_PROMPT_TOKENS = int(os.getenv("MAX_PROMPT_TOKENS", 32000))
+
+# AUTO mode: long texts up to this many (estimated) tokens are sent straight to generation
+# (split into chunks); the summary is only produced if that generation fails
+SPECULATIVE_GENERATE_MAX_TOKENS = int(os.getenv("SPECULATIVE_GENERATE_MAX_TOKENS", 8000))
+
+# Questions whose character-shingle Jaccard similarity reaches this value are
+# treated as near-duplicates and dropped before evaluation
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", 0.7))
+
+# Persistent LLM result cache (SQLite, shared by all workers on the host)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "cache/llm_cache.sqlite3")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", 512))
+
+# In-memory per-question evaluation cache budget (LRU, per worker process)
+EVAL_CACHE_MAX_MB = int(os.getenv("EVAL_CACHE_MAX_MB", 32))
+
+# GET /questions: total_count per (user, filter) is cached in memory for this long
+# (per worker process; writes made through this worker invalidate it immediately)
+QUESTION_COUNT_CACHE_SECONDS = int(os.getenv("QUESTION_COUNT_CACHE_SECONDS", 60))
+QUESTION_COUNT_CACHE_ENTRIES = int(os.getenv("QUESTION_COUNT_CACHE_ENTRIES", 10000))
+
+# Evaluation: questions per Gemini call and max concurrent calls per evaluate_mcq
+EVAL_BATCH_SIZE = int(os.getenv("EVAL_BATCH_SIZE", 5))
+EVAL_MAX_PARALLEL_BATCHES = int(os.getenv("EVAL_MAX_PARALLEL_BATCHES", 4))
+
+# Background generation jobs (SQLite queue shared by all workers on the host)
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "cache/jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", 5))
+# A running job whose heartbeat is older than this is considered orphaned and re-queued
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", 120))
+# Finished jobs are deleted after this long
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", 7 * 24 * 3600))
+
+# Batch ingestion (/agent/batch): max documents per request, documents generated
+# concurrently, and max size of an uploaded ZIP archive
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 50))
+BATCH_MAX_PARALLEL_FILES = int(os.getenv("BATCH_MAX_PARALLEL_FILES", 8))
+BATCH_MAX_ARCHIVE_MB = int(os.getenv("BATCH_MAX_ARCHIVE_MB", 200))
+
+# PDF extraction: PDFs with at least this many pages are split across a process pool
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", 100))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", min(4, os.cpu_count() or 1)))
+
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM")
 JWT_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES"))
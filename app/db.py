@@ -1,7 +1,17 @@
 # db.py
+import asyncio
+import functools
+import json
 import mariadb
 import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from .metrics import DB_POOL_CONNECTIONS, DB_POOL_EVENTS, DB_POOL_WAIT, DB_QUERY_DURATION, POOL_BUSY, POOL_SIZE
 
 load_dotenv()
 
@@ -14,75 +24,520 @@ DB_CONFIG = {
     "autocommit": False,  # Giữ nguyên False
 }
 
+# Pool kết nối (mỗi worker process một pool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+# Chờ tối đa bao lâu để mượn được kết nối khi pool đã dùng hết
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", 10))
+# Kết nối rảnh lâu hơn ngưỡng này được ping trước khi cho mượn
+DB_POOL_PRE_PING_SECONDS = float(os.getenv("DB_POOL_PRE_PING_SECONDS", 5))
+# Kết nối sống lâu hơn ngưỡng này bị đóng và mở lại (tránh wait_timeout của server)
+DB_POOL_RECYCLE_SECONDS = float(os.getenv("DB_POOL_RECYCLE_SECONDS", 1800))
+# Số thread chạy truy vấn cho route async (run_db); mặc định bằng kích thước pool
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", DB_POOL_SIZE))
+
+# Thiết lập session, chạy MỘT lần khi pool mở kết nối (không lặp lại ở mỗi truy vấn)
+DB_CHARSET = os.getenv("DB_CHARSET", "utf8mb4")
+DB_COLLATION = os.getenv("DB_COLLATION", "utf8mb4_vietnamese_ci")
+# Rỗng = giữ time_zone của server (NOW() trả về giờ như trước); ví dụ "+07:00"
+DB_TIME_ZONE = os.getenv("DB_TIME_ZONE", "")
+DB_ISOLATION_LEVEL = os.getenv("DB_ISOLATION_LEVEL", "REPEATABLE READ").upper()
+
+_ISOLATION_LEVELS = {"READ UNCOMMITTED", "READ COMMITTED", "REPEATABLE READ", "SERIALIZABLE"}
+if DB_ISOLATION_LEVEL not in _ISOLATION_LEVELS:
+    raise ValueError(f"DB_ISOLATION_LEVEL không hợp lệ: {DB_ISOLATION_LEVEL!r} ({' | '.join(sorted(_ISOLATION_LEVELS))})")
+for _name, _value in (("DB_CHARSET", DB_CHARSET), ("DB_COLLATION", DB_COLLATION)):
+    if not re.fullmatch(r"\w+", _value):
+        raise ValueError(f"{_name} không hợp lệ: {_value!r}")
+
+def session_init_statements() -> list:
+    """Các câu lệnh (sql, params) thiết lập session cho một kết nối mới."""
+    statements = [(f"SET NAMES '{DB_CHARSET}' COLLATE '{DB_COLLATION}'", ())]
+    if DB_TIME_ZONE:
+        statements.append(("SET time_zone = %s", (DB_TIME_ZONE,)))
+    statements.append((f"SET SESSION TRANSACTION ISOLATION LEVEL {DB_ISOLATION_LEVEL}", ()))
+    return statements
+
+@contextmanager
+def timed_query(operation: str):
+    """Ghi thời gian một thao tác DB vào mcq_db_query_duration_seconds{operation}."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        DB_QUERY_DURATION.observe(time.perf_counter() - start, operation=operation, outcome=outcome)
+
+class PoolTimeoutError(mariadb.Error):
+    """Không mượn được kết nối trong DB_POOL_TIMEOUT_SECONDS (pool đã dùng hết)."""
+
+class PooledConnection:
+    """
+    Kết nối mượn từ pool: dùng y như kết nối mariadb, nhưng close() trả kết nối về pool
+    (có rollback phần giao dịch còn dở) thay vì đóng socket. Gọi close() nhiều lần không sao.
+    """
+
+    def __init__(self, pool: "ConnectionPool", raw, created_at: float):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            raise mariadb.Error("Kết nối đã được trả về pool.")
+        return getattr(raw, name)
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool._release(raw, self._created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        # Lưới an toàn cho code quên close(): vẫn trả kết nối về pool
+        if self.__dict__.get("_raw") is not None:
+            self._pool._event("leaked")
+            print("⚠️  Kết nối DB không được close(), trả về pool khi bị thu hồi.")
+            self.close()
+
+class ConnectionPool:
+    """
+    Pool kết nối MariaDB dùng chung giữa các thread (route sync chạy trong threadpool).
+    - Tối đa `size` kết nối mở cùng lúc, mở dần khi cần;
+    - hết kết nối → chờ tối đa `timeout` giây rồi ném PoolTimeoutError;
+    - pre-ping kết nối rảnh lâu, bỏ kết nối hỏng / quá `recycle` giây;
+    - thống kê ở stats() và metrics mcq_db_pool_*.
+    """
+
+    def __init__(self, config: dict, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT_SECONDS,
+                 pre_ping: float = DB_POOL_PRE_PING_SECONDS, recycle: float = DB_POOL_RECYCLE_SECONDS,
+                 init_statements=None):
+        self.config = config
+        self.init_statements = list(init_statements or ())
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self.recycle = recycle
+        self._idle = deque()  # (raw, created_at, last_used)
+        self._open = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._events = {"checkout": 0, "connect": 0, "timeout": 0, "ping_failure": 0,
+                        "recycled": 0, "broken": 0, "leaked": 0}
+
+    def _event(self, name: str):
+        with self._cond:
+            self._events[name] += 1
+        if name != "checkout":
+            DB_POOL_EVENTS.inc(event=name)
+
+    @staticmethod
+    def _close_quietly(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _connect(self):
+        """Mở kết nối mới và thiết lập session (charset, time_zone, isolation level) một lần."""
+        with timed_query("connect"):
+            raw = mariadb.connect(**self.config)
+            try:
+                if self.init_statements:
+                    cur = raw.cursor()
+                    for sql, params in self.init_statements:
+                        cur.execute(sql, params)
+                    cur.close()
+            except BaseException:
+                self._close_quietly(raw)
+                raise
+        self._event("connect")
+        return raw
+
+    def _usable(self, raw, created_at: float, last_used: float) -> bool:
+        now = time.monotonic()
+        if now - created_at > self.recycle:
+            self._event("recycled")
+            return False
+        if now - last_used > self.pre_ping:
+            try:
+                raw.ping()
+            except Exception:
+                self._event("ping_failure")
+                return False
+        return True
+
+    def acquire(self) -> PooledConnection:
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        entry = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()  # LIFO: dùng lại kết nối "nóng" nhất
+                    break
+                if self._open < self.size:
+                    self._open += 1  # giữ chỗ, mở kết nối ngoài lock
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._events["timeout"] += 1
+                    DB_POOL_EVENTS.inc(event="timeout")
+                    raise PoolTimeoutError(f"Hết kết nối DB (pool {self.size}) sau {self.timeout:g}s chờ.")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._events["checkout"] += 1
+
+        # Từ đây request giữ một chỗ trong pool; lỗi thì nhả chỗ cho người khác
+        try:
+            raw = None
+            if entry is not None:
+                raw, created_at, last_used = entry
+                if not self._usable(raw, created_at, last_used):
+                    self._close_quietly(raw)
+                    raw = None
+            if raw is None:
+                raw = self._connect()
+                created_at = time.monotonic()
+        except BaseException:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+        return PooledConnection(self, raw, created_at)
+
+    def _release(self, raw, created_at: float):
+        try:
+            raw.rollback()  # không để giao dịch dở dang sang request sau
+        except Exception:
+            self._event("broken")
+            self._close_quietly(raw)
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((raw, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        """Đóng mọi kết nối đang rảnh (khi tắt app)."""
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+        for raw, _, _ in idle:
+            self._close_quietly(raw)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "waiting": self._waiting,
+                "events": dict(self._events),
+            }
+
+db_pool = ConnectionPool(DB_CONFIG, init_statements=session_init_statements())
+DB_POOL_CONNECTIONS.set_function(lambda: {
+    (state,): value for state, value in db_pool.stats().items() if state != "events"
+})
+
 def get_connection():
-    """Tạo và trả về một kết nối mới đến MariaDB."""
+    """Mượn một kết nối MariaDB từ pool; conn.close() trả nó về pool."""
     try:
-        conn = mariadb.connect(**DB_CONFIG)
-        # === XÓA SET NAMES KHỎI HÀM NÀY ===
-        # Lệnh này sẽ được chuyển vào các hàm 'call_sp'
-        return conn
+        return db_pool.acquire()
     except mariadb.Error as e:
         print("❌ Lỗi kết nối database:", e)
         raise
 
-def call_sp_save_file(uploader_id, filename, file_type, storage_path, raw_text, summary):
-    """Gọi sp_SaveFile, đảm bảo SET NAMES chạy đúng."""
+def get_db():
+    """Dependency FastAPI: mượn kết nối cho request và luôn trả về pool khi request xong."""
     conn = get_connection()
     try:
-        cur = conn.cursor()
-        
-        # === THÊM SET NAMES VÀO ĐÂY ===
-        cur.execute("SET NAMES 'utf8mb4' COLLATE 'utf8mb4_vietnamese_ci'")
-        
-        # Gọi procedure
-        cur.execute("CALL sp_SaveFile(?, ?, ?, ?, ?, ?, @out_file_id)", (
-            uploader_id, filename, file_type, storage_path, raw_text, summary
-        ))
-        # Lấy giá trị OUT param
-        cur.execute("SELECT @out_file_id")
-        row = cur.fetchone()
-        
-        conn.commit() # Xác nhận giao dịch
-        
-        cur.close()
-        conn.close()
-        return int(row[0]) if row and row[0] else 0
-    except Exception as e:
-        conn.rollback() # Hoàn tác nếu có lỗi
-        raise e
+        yield conn
     finally:
+        conn.close()
+
+_db_executor = None
+_db_executor_lock = threading.Lock()
+
+def _get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    with _db_executor_lock:
+        if _db_executor is None:
+            _db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+            POOL_SIZE.set(DB_EXECUTOR_WORKERS, pool="db")
+        return _db_executor
+
+def _run_with_connection(func, args, kwargs):
+    POOL_BUSY.inc(pool="db")
+    try:
+        conn = get_connection()
         try:
-            cur.close()
+            return func(conn, *args, **kwargs)
+        finally:
             conn.close()
-        except:
-            pass
+    finally:
+        POOL_BUSY.dec(pool="db")
 
-def call_sp_save_question_with_eval(
-    source_file_id, creator_id, question_text, options_json, answer_letter, status,
-    model_version, total_score, accuracy_score, alignment_score,
-    distractors_score, clarity_score, status_by_agent, raw_response_json
-):
-    """Gọi sp_SaveQuestionWithEval để lưu question + evaluation."""
-    conn = get_connection()
+async def run_in_db_executor(func, *args, **kwargs):
+    """
+    Chạy `func(*args, **kwargs)` đồng bộ trên executor DB (không mượn kết nối MariaDB) — cho
+    các thao tác I/O khác của route (ví dụ job store SQLite) cùng chịu giới hạn số thread.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_db_executor(), functools.partial(func, *args, **kwargs))
+
+async def run_db(func, *args, **kwargs):
+    """
+    Chạy `func(conn, *args, **kwargs)` (code mariadb đồng bộ) trên executor DB riêng, với một
+    kết nối mượn từ pool và luôn được trả về sau đó. Route async dùng hàm này thay vì gọi
+    cursor trực tiếp: event loop không bị chặn, và số truy vấn chạy song song bằng số thread
+    của executor (mặc định = DB_POOL_SIZE) — request dư xếp hàng chứ không giữ thread chờ kết nối.
+    HTTPException / lỗi DB ném trong func được ném lại nguyên vẹn cho route.
+    """
+    return await run_in_db_executor(_run_with_connection, func, args, kwargs)
+
+def shutdown_db_executor():
+    """Dừng executor DB (khi tắt app), chờ các truy vấn đang chạy xong."""
+    global _db_executor
+    with _db_executor_lock:
+        executor, _db_executor = _db_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+def fetch_existing_questions(conn, source_file_id, creator_id):
+    """
+    Câu hỏi user đã lưu cho một file ({"question", "options"}, dùng để lọc câu hỏi gần trùng).
+    Gọi qua run_db.
+    """
+    cur = conn.cursor()
+    with timed_query("fetch_existing_questions"):
+        cur.execute(
+            "SELECT question_text, options FROM Questions"
+            " WHERE source_file_id = %s AND creator_id = %s AND COALESCE(status, '') <> 'superseded'",
+            (source_file_id, creator_id),
+        )
+        rows = cur.fetchall()
+    cur.close()
+
+    questions = []
+    for question_text, options in rows:
+        # /agent/save lưu question_text / options dạng chuỗi JSON; dữ liệu cũ có thể là text thường
+        try:
+            value = json.loads(question_text)
+        except Exception:
+            value = question_text
+        try:
+            options = json.loads(options)
+        except Exception:
+            options = []
+        if isinstance(value, str) and value:
+            questions.append({"question": value, "options": options if isinstance(options, list) else []})
+    return questions
+
+def fetch_previous_version(conn, file_id, uploader_id):
+    """
+    Bản đã lưu của một file để chạy incremental khi upload lại:
+    {"summary", "chunks": {chunk_hash: [câu hỏi đã lưu sinh từ chunk đó]}}.
+    Trả về None nếu file không thuộc user, chưa có FileChunks, hoặc không câu hỏi nào
+    gắn được với chunk (ví dụ sinh từ bản tóm tắt) — khi đó phải sinh lại toàn bộ.
+    Gọi qua run_db.
+    """
+    cur = conn.cursor(dictionary=True)
+    try:
+        with timed_query("fetch_previous_version"):
+            cur.execute("SELECT summary FROM Files WHERE file_id = %s AND uploader_id = %s", (file_id, uploader_id))
+            file_row = cur.fetchone()
+            if not file_row:
+                return None
+            cur.execute("SELECT chunk_hash FROM FileChunks WHERE file_id = %s", (file_id,))
+            chunk_rows = cur.fetchall()
+            cur.execute("""
+                SELECT q.question_id, q.question_text, q.options, q.answer_letter, q.status,
+                       e.total_score, e.accuracy_score, e.alignment_score,
+                       e.distractors_score, e.clarity_score, e.raw_response_json
+                FROM Questions q
+                LEFT JOIN QuestionEvaluations e ON q.latest_evaluation_id = e.evaluation_id
+                WHERE q.source_file_id = %s AND q.creator_id = %s AND COALESCE(q.status, '') <> 'superseded'
+            """, (file_id, uploader_id))
+            question_rows = cur.fetchall()
+    finally:
+        cur.close()
+
+    chunks = {row["chunk_hash"]: [] for row in chunk_rows}
+    tagged = 0
+    for row in question_rows:
+        try:
+            raw = json.loads(row["raw_response_json"] or "{}")
+        except Exception:
+            raw = {}
+        tag = raw.get("_chunk_hash") if isinstance(raw, dict) else None
+        if tag not in chunks:
+            continue
+        question = {**raw, "question_id": row["question_id"]}
+        # Lấy nội dung hiện tại trong DB (giảng viên có thể đã sửa câu hỏi sau khi lưu)
+        for key, column in (("question", "question_text"), ("options", "options")):
+            try:
+                question[key] = json.loads(row[column])
+            except Exception:
+                question[key] = row[column]
+        question["answer_letter"] = row["answer_letter"]
+        question["status"] = row["status"]
+        if row["total_score"] is not None:
+            question["score"] = row["total_score"]
+            question["_eval_breakdown"] = {
+                "accuracy": row["accuracy_score"],
+                "alignment": row["alignment_score"],
+                "distractors": row["distractors_score"],
+                "clarity": row["clarity_score"],
+            }
+        chunks[tag].append(question)
+        tagged += 1
+
+    if not tagged:
+        return None
+    return {"summary": file_row["summary"], "chunks": chunks}
+
+# Số dòng mỗi câu INSERT nhiều dòng (giới hạn kích thước packet: raw_response_json có thể dài)
+BULK_INSERT_ROWS = int(os.getenv("BULK_INSERT_ROWS", 100))
+
+_QUESTION_COLUMNS = "(source_file_id, creator_id, question_text, options, answer_letter, status, created_at)"
+_EVALUATION_COLUMNS = (
+    "(question_id, model_version, total_score, accuracy_score, alignment_score,"
+    " distractors_score, clarity_score, status_by_agent, raw_response_json)"
+)
+
+_consecutive_ids = None
+
+def _insert_ids_consecutive(cur) -> bool:
+    """
+    True nếu một câu INSERT nhiều dòng nhận id liên tiếp (LAST_INSERT_ID() là id dòng đầu):
+    innodb_autoinc_lock_mode 0/1 và auto_increment_increment = 1. Hỏi server một lần mỗi process.
+    """
+    global _consecutive_ids
+    if _consecutive_ids is None:
+        cur.execute("SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment")
+        lock_mode, increment = cur.fetchone()
+        _consecutive_ids = int(lock_mode) < 2 and int(increment) == 1
+    return _consecutive_ids
+
+def _batches(rows, size=None):
+    size = size or BULK_INSERT_ROWS
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+def _insert_questions(cur, source_file_id, creator_id, questions) -> list:
+    """INSERT các câu hỏi theo batch nhiều dòng, trả về question_id theo đúng thứ tự."""
+    rows = [(source_file_id, creator_id, q["question_text"], q["options_json"], q["answer_letter"], q["status"])
+            for q in questions]
+    if not _insert_ids_consecutive(cur):
+        # Server cấp id xen kẽ: vẫn cùng giao dịch, nhưng mỗi dòng một INSERT để lấy đúng id
+        ids = []
+        for row in rows:
+            cur.execute(f"INSERT INTO Questions {_QUESTION_COLUMNS} VALUES (%s, %s, %s, %s, %s, %s, NOW())", row)
+            ids.append(cur.lastrowid)
+        return ids
+    ids = []
+    for batch in _batches(rows):
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, NOW())"] * len(batch))
+        cur.execute(f"INSERT INTO Questions {_QUESTION_COLUMNS} VALUES {values}", [v for row in batch for v in row])
+        first_id = cur.lastrowid
+        ids.extend(range(first_id, first_id + len(batch)))
+    return ids
+
+def _insert_evaluations(cur, question_ids, questions) -> None:
+    """INSERT đánh giá của từng câu rồi gán latest_evaluation_id cho cả batch bằng một UPDATE."""
+    rows = [(question_id, q["model_version"], q["total_score"], q["accuracy_score"], q["alignment_score"],
+             q["distractors_score"], q["clarity_score"], q["status_by_agent"], q["raw_response_json"])
+            for question_id, q in zip(question_ids, questions)]
+    for batch in _batches(rows):
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(batch))
+        cur.execute(f"INSERT INTO QuestionEvaluations {_EVALUATION_COLUMNS} VALUES {values}",
+                    [v for row in batch for v in row])
+    for batch in _batches(list(question_ids)):
+        placeholders = ", ".join(["%s"] * len(batch))
+        cur.execute(f"""
+            UPDATE Questions q
+            JOIN QuestionEvaluations e ON e.question_id = q.question_id
+            SET q.latest_evaluation_id = e.evaluation_id
+            WHERE q.question_id IN ({placeholders})
+        """, batch)
+
+def _replace_file_chunks(cur, file_id, chunk_hashes) -> None:
+    cur.execute("DELETE FROM FileChunks WHERE file_id = %s", (file_id,))
+    for batch in _batches(list(enumerate(chunk_hashes)), 500):
+        values = ", ".join(["(%s, %s, %s)"] * len(batch))
+        cur.execute(f"INSERT INTO FileChunks (file_id, chunk_index, chunk_hash) VALUES {values}",
+                    [v for i, h in batch for v in (file_id, i, h)])
+
+def _supersede_stale_questions(cur, file_id, creator_id) -> None:
+    # Câu hỏi sinh từ chunk không còn trong bản mới (đã sửa / xóa) → status 'superseded'
+    cur.execute("""
+        UPDATE Questions q
+        JOIN QuestionEvaluations e ON e.evaluation_id = q.latest_evaluation_id
+        SET q.status = 'superseded', q.updated_at = NOW()
+        WHERE q.source_file_id = %s AND q.creator_id = %s AND COALESCE(q.status, '') <> 'superseded'
+          AND JSON_VALUE(e.raw_response_json, '$._chunk_hash') IS NOT NULL
+          AND JSON_VALUE(e.raw_response_json, '$._chunk_hash') NOT IN
+              (SELECT chunk_hash FROM FileChunks WHERE file_id = %s)
+    """, (file_id, creator_id, file_id))
+
+def save_agent_result_bulk(conn, uploader_id, filename, file_type, raw_text, summary, questions,
+                           chunk_hashes=(), source_file_id=None):
+    """
+    Lưu kết quả agent trong MỘT giao dịch, một kết nối: file (tạo mới, hoặc cập nhật
+    source_file_id nếu là re-upload), danh sách chunk_hash, mọi câu hỏi + đánh giá
+    (INSERT nhiều dòng) và latest_evaluation_id. Khi re-upload, câu hỏi cũ sinh từ chunk
+    không còn trong bản mới được đánh dấu status='superseded'.
+
+    `questions`: list dict có question_text, options_json, answer_letter, status, model_version,
+    total_score, accuracy_score, alignment_score, distractors_score, clarity_score,
+    status_by_agent, raw_response_json (cột của Questions / QuestionEvaluations).
+    Trả về file_id, hoặc None nếu source_file_id không thuộc user. Gọi qua run_db.
+    """
     try:
         cur = conn.cursor()
-        cur.execute("SET NAMES 'utf8mb4' COLLATE 'utf8mb4_vietnamese_ci'")
-        cur.execute("""
-            CALL sp_SaveQuestionWithEval(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            source_file_id, creator_id, question_text, options_json, answer_letter, status,
-            model_version, total_score, accuracy_score, alignment_score,
-            distractors_score, clarity_score, status_by_agent, raw_response_json
-        ))
-        conn.commit()
+        with timed_query("save_agent_result_bulk"):
+            if source_file_id:
+                cur.execute("SELECT 1 FROM Files WHERE file_id = %s AND uploader_id = %s FOR UPDATE",
+                            (source_file_id, uploader_id))
+                if not cur.fetchone():
+                    conn.rollback()
+                    return None
+                cur.execute(
+                    "UPDATE Files SET filename = %s, file_type = %s, raw_text = %s, summary = %s WHERE file_id = %s",
+                    (filename, file_type, raw_text, summary, source_file_id),
+                )
+                file_id = int(source_file_id)
+            else:
+                cur.execute("""
+                    INSERT INTO Files (uploader_id, filename, file_type, uploaded_at, storage_path, raw_text, summary)
+                    VALUES (%s, %s, %s, NOW(), NULL, %s, %s)
+                """, (uploader_id, filename, file_type, raw_text, summary))
+                file_id = cur.lastrowid
+
+            _replace_file_chunks(cur, file_id, chunk_hashes)
+            if source_file_id:
+                _supersede_stale_questions(cur, file_id, uploader_id)
+            if questions:
+                question_ids = _insert_questions(cur, file_id, uploader_id, questions)
+                _insert_evaluations(cur, question_ids, questions)
+            conn.commit()
         cur.close()
-        conn.close()
-    except Exception as e:
+        return file_id
+    except Exception:
         conn.rollback()
-        raise e
-    finally:
-        try:
-            cur.close()
-            conn.close()
-        except:
-            pass
\ No newline at end of file
+        raise
@@ -0,0 +1,109 @@
+"""Lọc câu hỏi gần trùng (paraphrase) cục bộ, không gọi LLM.
+
+Mỗi câu hỏi → chữ ký văn bản (câu dẫn + các lựa chọn, xem question_signature) → tập shingle
+ký tự (k ký tự liên tiếp của chữ ký đã chuẩn hóa) → chữ ký MinHash.
+Chỉ số LSH (chia chữ ký thành các band) tìm nhanh ứng viên gần giống, sau đó xác nhận bằng
+Jaccard thật trên tập shingle. Hai câu có Jaccard ≥ threshold được coi là trùng.
+"""
+import random
+import re
+import zlib
+from typing import Iterable, List, Tuple
+from .config import NEAR_DUPLICATE_THRESHOLD
+from .utils import normalize_question_key
+
+SHINGLE_SIZE = 4
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+_MAX_HASH = (1 << 32) - 1
+# "Hoán vị" rẻ: crc32(shingle) XOR mask. Đủ tốt để sinh ứng viên vì mọi ứng viên
+# đều được kiểm tra lại bằng Jaccard thật.
+_rng = random.Random(20251024)
+_MASKS = [_rng.getrandbits(32) for _ in range(NUM_PERM)]
+
+_OPTION_LABEL_RE = re.compile(r"^\s*[A-Da-d]\s*[.):]\s*")
+
+def question_signature(question) -> str:
+    """
+    Văn bản dùng để so trùng: câu dẫn + các lựa chọn (bỏ nhãn "A.", sắp xếp để không phụ thuộc
+    thứ tự). Câu dẫn chung chung ("Phát biểu nào sau đây là đúng?") với lựa chọn khác nhau
+    không bị coi là trùng. Nhận dict câu hỏi ({"question", "options"}) hoặc chuỗi câu dẫn.
+    """
+    if not isinstance(question, dict):
+        return str(question or "")
+    options = question.get("options")
+    options = options if isinstance(options, list) else []
+    parts = sorted(_OPTION_LABEL_RE.sub("", str(o)) for o in options)
+    return " | ".join([str(question.get("question") or "")] + parts)
+
+def shingles(text: str, k: int = SHINGLE_SIZE) -> frozenset:
+    normalized = normalize_question_key(text)
+    if len(normalized) <= k:
+        return frozenset([normalized]) if normalized else frozenset()
+    return frozenset(normalized[i:i + k] for i in range(len(normalized) - k + 1))
+
+def minhash(shingle_set: Iterable[str]) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingle_set]
+    if not hashes:
+        return (_MAX_HASH,) * NUM_PERM
+    return tuple(min([h ^ mask for h in hashes]) for mask in _MASKS)
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+class NearDuplicateIndex:
+    """
+    Tập câu hỏi đã có; `add_if_new` trả về False nếu câu mới gần trùng một câu trong tập.
+    Các method nhận văn bản đã qua question_signature.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self._shingles: List[frozenset] = []
+        self._buckets = [{} for _ in range(BANDS)]
+
+    def __len__(self) -> int:
+        return len(self._shingles)
+
+    def _bands(self, signature: Tuple[int, ...]):
+        return [signature[i * ROWS:(i + 1) * ROWS] for i in range(BANDS)]
+
+    def find(self, text: str) -> int:
+        """Vị trí câu gần trùng nhất trong index (-1 nếu không có)."""
+        candidate = shingles(text)
+        return self._find(candidate, self._bands(minhash(candidate)))
+
+    def _find(self, candidate: frozenset, bands) -> int:
+        seen = set()
+        best, best_score = -1, self.threshold
+        for bucket, band in zip(self._buckets, bands):
+            for idx in bucket.get(band, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                score = jaccard(candidate, self._shingles[idx])
+                if score >= best_score:
+                    best, best_score = idx, score
+        return best
+
+    def add(self, text: str) -> None:
+        candidate = shingles(text)
+        self._insert(candidate, self._bands(minhash(candidate)))
+
+    def _insert(self, candidate: frozenset, bands) -> None:
+        idx = len(self._shingles)
+        self._shingles.append(candidate)
+        for bucket, band in zip(self._buckets, bands):
+            bucket.setdefault(band, []).append(idx)
+
+    def add_if_new(self, text: str) -> bool:
+        candidate = shingles(text)
+        bands = self._bands(minhash(candidate))
+        if self._find(candidate, bands) >= 0:
+            return False
+        self._insert(candidate, bands)
+        return True
@@ -0,0 +1,326 @@
+"""Hàng đợi job sinh câu hỏi chạy nền.
+
+- Job lưu trong SQLite (JOBS_DB_PATH) nên không mất khi restart, và mọi worker uvicorn
+  trên cùng máy dùng chung một hàng đợi.
+- Mỗi process chạy JOB_WORKERS worker (asyncio task). Worker nhận job trong một
+  transaction BEGIN IMMEDIATE nên hai worker không bao giờ nhận trùng một job.
+- Job đang chạy được gửi heartbeat định kỳ; job "running" có heartbeat quá cũ
+  (process chết giữa chừng) được đưa trở lại hàng đợi, hoặc đánh dấu failed nếu
+  đã dùng hết JOB_MAX_ATTEMPTS lần thử.
+- Job lỗi được thử lại với backoff tăng dần, tối đa JOB_MAX_ATTEMPTS lần.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+from .agent import Agent
+from .config import (
+    JOBS_DB_PATH,
+    JOB_WORKERS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_BASE_SECONDS,
+    JOB_STALE_SECONDS,
+    JOB_RESULT_TTL_SECONDS,
+)
+from .metrics import JOB_QUEUE, JOBS_FINISHED
+from .tools import contains_failed_generation
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+class JobStore:
+    """Bảng `jobs` trên SQLite. Mọi method đều đồng bộ — gọi qua asyncio.to_thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS jobs (
+                            job_id TEXT PRIMARY KEY,
+                            user_id INTEGER NOT NULL,
+                            kind TEXT NOT NULL,
+                            status TEXT NOT NULL,
+                            payload TEXT NOT NULL,
+                            progress TEXT,
+                            result TEXT,
+                            error TEXT,
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            available_at REAL NOT NULL,
+                            heartbeat_at REAL,
+                            worker TEXT,
+                            created_at REAL NOT NULL,
+                            updated_at REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, available_at)")
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    def create(self, user_id: int, kind: str, payload: dict) -> str:
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        self._conn().execute(
+            """INSERT INTO jobs (job_id, user_id, kind, status, payload, available_at, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (job_id, user_id, kind, QUEUED, json.dumps(payload, ensure_ascii=False), now, now, now),
+        )
+        return job_id
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """Nhận (atomically) job sẵn sàng cũ nhất; đồng thời thu hồi các job mồ côi."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Job mồ côi còn lượt thử → hàng đợi; hết lượt (worker chết / treo lặp lại) → failed
+            conn.execute(
+                """UPDATE jobs SET status = ?, worker = NULL, updated_at = ?
+                   WHERE status = ? AND heartbeat_at < ? AND attempts < ?""",
+                (QUEUED, now, RUNNING, now - JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS),
+            )
+            conn.execute(
+                """UPDATE jobs SET status = ?, worker = NULL, error = ?, updated_at = ?
+                   WHERE status = ? AND heartbeat_at < ?""",
+                (FAILED, f"Worker dừng giữa chừng (mất heartbeat) sau {JOB_MAX_ATTEMPTS} lần thử.",
+                 now, RUNNING, now - JOB_STALE_SECONDS),
+            )
+            row = conn.execute(
+                """SELECT * FROM jobs WHERE status = ? AND available_at <= ?
+                   ORDER BY available_at, created_at LIMIT 1""",
+                (QUEUED, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    """UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?,
+                       heartbeat_at = ?, updated_at = ? WHERE job_id = ?""",
+                    (RUNNING, worker, now, now, row["job_id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job = dict(row)
+        job["attempts"] += 1
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def heartbeat(self, job_id: str, progress: Optional[dict] = None) -> None:
+        now = time.time()
+        if progress is None:
+            self._conn().execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND status = ?", (now, job_id, RUNNING)
+            )
+        else:
+            self._conn().execute(
+                "UPDATE jobs SET heartbeat_at = ?, progress = ?, updated_at = ? WHERE job_id = ? AND status = ?",
+                (now, json.dumps(progress, ensure_ascii=False), now, job_id, RUNNING),
+            )
+
+    def complete(self, job_id: str, result: dict) -> None:
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, updated_at = ? WHERE job_id = ?",
+            (SUCCEEDED, json.dumps(result, ensure_ascii=False), now, job_id),
+        )
+
+    def fail(self, job_id: str, error: str, retry_at: Optional[float] = None) -> None:
+        """retry_at != None → đưa lại vào hàng đợi từ thời điểm đó, ngược lại đánh dấu failed."""
+        now = time.time()
+        if retry_at is None:
+            self._conn().execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                (FAILED, error, now, job_id),
+            )
+        else:
+            self._conn().execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ?, worker = NULL, updated_at = ? WHERE job_id = ?",
+                (QUEUED, error, retry_at, now, job_id),
+            )
+
+    def release(self, job_id: str) -> None:
+        """Trả job đang chạy về hàng đợi mà không tính lần thử (khi tắt server)."""
+        now = time.time()
+        self._conn().execute(
+            """UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), worker = NULL,
+               available_at = ?, updated_at = ? WHERE job_id = ? AND status = ?""",
+            (QUEUED, now, now, job_id, RUNNING),
+        )
+
+    def get(self, job_id: str, user_id: int) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT * FROM jobs WHERE job_id = ? AND user_id = ?", (job_id, user_id)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for field in ("payload", "progress", "result"):
+            if job[field] is not None:
+                job[field] = json.loads(job[field])
+        return job
+
+    def counts(self) -> dict:
+        """Số job theo trạng thái (cho metrics mcq_jobs)."""
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {(status,): 0 for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        counts.update({(row[0],): row[1] for row in rows})
+        return counts
+
+    def purge(self) -> int:
+        """Xóa các job đã kết thúc quá JOB_RESULT_TTL_SECONDS."""
+        cur = self._conn().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (SUCCEEDED, FAILED, time.time() - JOB_RESULT_TTL_SECONDS),
+        )
+        return cur.rowcount
+
+async def _run_text_job(payload: dict, on_event) -> dict:
+    result = await _agent.decide_and_run(
+        payload["text"],
+        num_questions=payload["num_questions"],
+        summary_mode=payload["summary_mode"],
+        on_event=on_event,
+        existing_questions=payload.get("existing_questions"),
+        previous=payload.get("previous"),
+    )
+    questions = result.get("questions", []) or []
+    if contains_failed_generation(questions):
+        # Gemini lỗi / trả JSON hỏng: coi là lỗi tạm thời để được thử lại.
+        # Danh sách rỗng (mọi câu trùng với câu đã lưu, không chunk nào cần sinh lại) là kết quả hợp lệ.
+        raise RuntimeError("Gemini không sinh được câu hỏi hợp lệ.")
+    return {
+        "filename": payload["filename"],
+        "file_type": payload["file_type"],
+        "summary": result.get("summary"),
+        "questions": questions,
+        "duplicates_dropped": result.get("duplicates_dropped", 0),
+        "source_file_id": payload.get("source_file_id"),
+        "mode": result.get("mode"),
+    }
+
+# kind -> async handler(payload, on_event) -> result
+JOB_HANDLERS = {
+    "text": _run_text_job,
+}
+
+class JobWorkerPool:
+    """Các worker asyncio trong process hiện tại, lấy job từ JobStore."""
+
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, store: JobStore, workers: int):
+        self.store = store
+        self.workers = workers
+        self._tasks = []
+        self._wakeup = None
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        purged = await asyncio.to_thread(self.store.purge)
+        if purged:
+            print(f"🧹 Đã xóa {purged} job cũ.")
+        for i in range(self.workers):
+            name = f"{os.getpid()}-{i}"
+            self._tasks.append(asyncio.create_task(self._worker(name)))
+        print(f"🚀 Đã khởi động {self.workers} job worker.")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        """Đánh thức worker ngay khi có job mới (thay vì chờ hết POLL_INTERVAL)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def submit(self, user_id: int, kind: str, payload: dict) -> str:
+        job_id = await asyncio.to_thread(self.store.create, user_id, kind, payload)
+        self.notify()
+        return job_id
+
+    async def _worker(self, name: str) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim, name)
+            except sqlite3.Error as e:
+                print(f"⚠️  Lỗi đọc hàng đợi job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: dict) -> None:
+        job_id = job["job_id"]
+        progress = {"stage": None, "stage_status": None, "summary_ready": False, "questions_done": 0}
+
+        async def on_event(event: str, data: dict):
+            if event == "stage":
+                progress["stage"] = data.get("stage")
+                progress["stage_status"] = data.get("status")
+            elif event == "summary":
+                progress["summary_ready"] = True
+            elif event == "question":
+                progress["questions_done"] = data.get("index", progress["questions_done"])
+            await asyncio.to_thread(self.store.heartbeat, job_id, dict(progress))
+
+        async def keep_alive():
+            while True:
+                await asyncio.sleep(JOB_STALE_SECONDS / 4)
+                await asyncio.to_thread(self.store.heartbeat, job_id)
+
+        heartbeat = asyncio.create_task(keep_alive())
+        print(f"⚙️  Job {job_id} ({job['kind']}) lần thử {job['attempts']}/{JOB_MAX_ATTEMPTS}...")
+        try:
+            handler = JOB_HANDLERS[job["kind"]]
+            result = await handler(job["payload"], on_event)
+        except asyncio.CancelledError:
+            await asyncio.shield(asyncio.to_thread(self.store.release, job_id))
+            raise
+        except Exception as e:
+            retry_at = None
+            if job["attempts"] < JOB_MAX_ATTEMPTS and job["kind"] in JOB_HANDLERS:
+                retry_at = time.time() + JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+            print(f"❌ Job {job_id} lỗi: {e}" + (" — sẽ thử lại." if retry_at else ""))
+            JOBS_FINISHED.inc(kind=job["kind"], outcome="retry" if retry_at else "failed")
+            await asyncio.to_thread(self.store.fail, job_id, str(e), retry_at)
+        else:
+            await asyncio.to_thread(self.store.complete, job_id, result)
+            JOBS_FINISHED.inc(kind=job["kind"], outcome="succeeded")
+            print(f"✅ Job {job_id} xong.")
+        finally:
+            heartbeat.cancel()
+
+_agent = Agent()
+job_store = JobStore(JOBS_DB_PATH)
+job_workers = JobWorkerPool(job_store, JOB_WORKERS)
+JOB_QUEUE.set_function(job_store.counts)
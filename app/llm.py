@@ -0,0 +1,278 @@
+"""Async gateway cho mọi lời gọi LLM.
+
+Tất cả hàm LLM trong tools.py (tóm tắt, sinh câu hỏi, đánh giá, audio) đi qua module này:
+- gọi qua một provider (LLM_PROVIDER): GeminiProvider (mặc định, dùng client async
+  `client.aio` nên không chặn event loop) hoặc FakeProvider (offline, tất định — dùng cho
+  benchmark / load test),
+- giới hạn số request đang chạy đồng thời bằng một semaphore,
+- ghi metrics: số request / lỗi, thời gian, token, mức bão hòa của semaphore.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+from .config import (
+    GOOGLE_API_KEY,
+    LLM_MAX_CONCURRENCY,
+    LLM_PROVIDER,
+    FAKE_LLM_LATENCY_MS,
+    FAKE_LLM_FAILURE_RATE,
+    FAKE_LLM_MALFORMED_RATE,
+    FAKE_LLM_OUTPUT_WORDS,
+    FAKE_LLM_SEED,
+)
+from .metrics import (
+    LLM_CONCURRENCY_LIMIT,
+    LLM_DURATION,
+    LLM_IN_FLIGHT,
+    LLM_REQUESTS,
+    LLM_TOKENS,
+    LLM_WAITING,
+)
+from .utils import estimate_tokens
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+LLM_CONCURRENCY_LIMIT.set(LLM_MAX_CONCURRENCY)
+
+class LLMProvider:
+    """Giao diện provider. generate() trả về (text, usage) với usage = {loại token: số token}."""
+
+    name = "base"
+
+    async def generate(self, contents, model_name: str, task: str) -> Tuple[str, Dict[str, int]]:
+        raise NotImplementedError
+
+    async def upload_file(self, file_path: str):
+        raise NotImplementedError
+
+    async def delete_file(self, uploaded_file) -> None:
+        raise NotImplementedError
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = GOOGLE_API_KEY):
+        self.api_key = api_key
+        self._client = None
+
+    @property
+    def client(self):
+        # Tạo client khi dùng lần đầu: import app không cần API key / thư viện genai
+        if self._client is None:
+            from google import genai
+            self._client = genai.Client(api_key=self.api_key)
+        return self._client
+
+    async def generate(self, contents, model_name: str, task: str) -> Tuple[str, Dict[str, int]]:
+        response = await self.client.aio.models.generate_content(
+            model=model_name,
+            contents=contents,
+        )
+        usage = {}
+        metadata = getattr(response, "usage_metadata", None)
+        if metadata is not None:
+            for kind, field in (("prompt", "prompt_token_count"), ("candidates", "candidates_token_count"),
+                                ("thoughts", "thoughts_token_count")):
+                count = getattr(metadata, field, None)
+                if count:
+                    usage[kind] = count
+        return response.text or "", usage
+
+    async def upload_file(self, file_path: str):
+        return await self.client.aio.files.upload(file=file_path)
+
+    async def delete_file(self, uploaded_file) -> None:
+        await self.client.aio.files.delete(name=uploaded_file.name)
+
+class FakeProviderError(RuntimeError):
+    pass
+
+class _FakeUpload:
+    def __init__(self, name: str):
+        self.name = name
+
+class FakeProvider(LLMProvider):
+    """
+    Provider giả, không gọi mạng. Cùng seed + cùng prompt → cùng kết quả (kể cả việc lỗi).
+
+    - latency_ms: độ trễ mỗi request (±20% jitter tất định),
+    - failure_rate: xác suất một request ném FakeProviderError,
+    - malformed_rate: xác suất output JSON (generate / evaluate) bị cắt cụt giữa chừng,
+    - output_words: độ dài (số từ) của bản tóm tắt / transcript / context câu hỏi.
+
+    Output đúng định dạng mà tools.py chờ đợi cho từng task (JSON câu hỏi, JSON đánh giá...).
+    """
+
+    name = "fake"
+
+    _WORDS = (
+        "hệ thống sinh câu hỏi trắc nghiệm giúp giảng viên tạo đề nhanh chóng chính xác "
+        "dữ liệu mô hình kiểm tra đánh giá kiến thức học sinh nội dung bài giảng tài liệu"
+    ).split()
+
+    def __init__(self, latency_ms: float = 0, failure_rate: float = 0.0, output_words: int = 200, seed: int = 0,
+                 malformed_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.output_words = output_words
+        self.seed = seed
+        self._attempts: Dict[str, int] = {}
+
+    def _rng(self, task: str, prompt: str) -> random.Random:
+        digest = hashlib.sha256(f"{self.seed}\x00{task}\x00{prompt}".encode("utf-8")).hexdigest()
+        # Lần gọi lại cùng prompt (retry) có kết quả riêng nhưng vẫn tất định
+        attempt = self._attempts.get(digest, 0)
+        self._attempts[digest] = attempt + 1
+        return random.Random(f"{digest}:{attempt}")
+
+    def _sentence(self, rng: random.Random, words: int) -> str:
+        return " ".join(rng.choice(self._WORDS) for _ in range(max(1, words))).capitalize() + "."
+
+    async def generate(self, contents, model_name: str, task: str) -> Tuple[str, Dict[str, int]]:
+        parts = contents if isinstance(contents, list) else [contents]
+        prompt = "\n".join(part for part in parts if isinstance(part, str))
+        rng = self._rng(task, prompt)
+
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms * rng.uniform(0.8, 1.2) / 1000)
+        if self.failure_rate and rng.random() < self.failure_rate:
+            raise FakeProviderError(f"Fake provider: lỗi giả lập ({task}).")
+
+        if task == "generate":
+            text = self._fake_questions(rng, prompt)
+        elif task == "evaluate":
+            text = self._fake_evaluation(rng, prompt)
+        else:
+            text = self._sentence(rng, self.output_words)
+        if task in ("generate", "evaluate") and self.malformed_rate and rng.random() < self.malformed_rate:
+            text = text[:int(len(text) * rng.uniform(0.3, 0.9))]
+        return text, {"prompt": estimate_tokens(prompt), "candidates": estimate_tokens(text)}
+
+    def _fake_questions(self, rng: random.Random, prompt: str) -> str:
+        match = re.search(r"\*\*(\d+) câu hỏi", prompt)
+        count = int(match.group(1)) if match else 5
+        context_words = max(5, self.output_words // 10)
+        questions = []
+        for i in range(count):
+            questions.append({
+                "context": self._sentence(rng, context_words),
+                "question": f"Câu hỏi {i + 1}: " + self._sentence(rng, 8).rstrip(".") + "?",
+                "options": [f"{letter}. " + self._sentence(rng, 3) for letter in "ABCD"],
+                "answer_letter": rng.choice("ABCD"),
+            })
+        return json.dumps(questions, ensure_ascii=False)
+
+    def _fake_evaluation(self, rng: random.Random, prompt: str) -> str:
+        marker = "**Danh sách câu hỏi:**"
+        questions = []
+        if marker in prompt:
+            try:
+                questions, _ = json.JSONDecoder().raw_decode(prompt[prompt.index(marker) + len(marker):].lstrip())
+            except ValueError:
+                questions = []
+        details = []
+        for q in questions if isinstance(questions, list) else []:
+            scores = {
+                "accuracy": rng.randint(30, 50),
+                "alignment": rng.randint(10, 25),
+                "distractors": rng.randint(8, 20),
+                "clarity": rng.randint(2, 5),
+            }
+            scores["total"] = sum(scores.values())
+            total = scores["total"]
+            status = "accepted" if total >= 80 else "need_review" if total >= 60 else "rejected"
+            question = q.get("question", "") if isinstance(q, dict) else ""
+            details.append({"question": question, "scores": scores, "status": status})
+        overall = round(sum(d["scores"]["total"] for d in details) / len(details), 1) if details else 0
+        return json.dumps({"overall_score": overall, "details": details}, ensure_ascii=False)
+
+    async def upload_file(self, file_path: str):
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return _FakeUpload(f"files/fake-{hashlib.sha256(file_path.encode('utf-8')).hexdigest()[:12]}")
+
+    async def delete_file(self, uploaded_file) -> None:
+        return None
+
+def _create_provider(name: str) -> LLMProvider:
+    if name == "gemini":
+        return GeminiProvider()
+    if name == "fake":
+        return FakeProvider(
+            latency_ms=FAKE_LLM_LATENCY_MS,
+            failure_rate=FAKE_LLM_FAILURE_RATE,
+            output_words=FAKE_LLM_OUTPUT_WORDS,
+            seed=FAKE_LLM_SEED,
+            malformed_rate=FAKE_LLM_MALFORMED_RATE,
+        )
+    raise ValueError(f"LLM_PROVIDER không hợp lệ: {name!r} (gemini | fake)")
+
+_provider: LLMProvider = _create_provider(LLM_PROVIDER)
+
+def get_provider() -> LLMProvider:
+    return _provider
+
+def set_provider(provider: LLMProvider) -> None:
+    """Đổi provider khi đang chạy (benchmark / load test)."""
+    global _provider
+    _provider = provider
+
+# Mỗi event loop có một semaphore riêng (asyncio.Semaphore gắn với loop đầu tiên dùng nó)
+_semaphores = weakref.WeakKeyDictionary()
+
+def _get_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _semaphores.get(loop)
+    if sem is None:
+        sem = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _semaphores[loop] = sem
+    return sem
+
+@asynccontextmanager
+async def _slot(task: str, model_name: str):
+    """Giữ một chỗ trong semaphore và ghi metrics cho request bên trong."""
+    sem = _get_semaphore()
+    LLM_WAITING.inc()
+    try:
+        await sem.acquire()
+    finally:
+        LLM_WAITING.dec()
+    LLM_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        LLM_IN_FLIGHT.dec()
+        sem.release()
+        LLM_DURATION.observe(time.perf_counter() - start, task=task, model=model_name)
+        LLM_REQUESTS.inc(task=task, model=model_name, outcome=outcome)
+
+async def generate_text(contents, model_name: str = DEFAULT_MODEL, task: str = "generate") -> str:
+    """
+    Gọi provider và trả về text đã strip.
+    `task` (summarize / generate / evaluate / audio_summary / audio_transcript) cho provider
+    biết loại output cần trả và dùng làm label metrics.
+    """
+    async with _slot(task, model_name):
+        text, usage = await _provider.generate(contents, model_name, task)
+    for kind, count in usage.items():
+        LLM_TOKENS.inc(count, task=task, model=model_name, kind=kind)
+    return (text or "").strip()
+
+async def upload_file(file_path: str):
+    """Upload file (audio...) lên Files API của provider, trả về handle để dùng trong contents."""
+    async with _slot("upload", "files"):
+        return await _provider.upload_file(file_path)
+
+async def delete_file(uploaded_file) -> None:
+    """Xóa file đã upload khỏi Files API của provider."""
+    await _provider.delete_file(uploaded_file)
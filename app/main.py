@@ -1,4 +1,7 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 from slowapi import Limiter, _rate_limit_exceeded_handler 
 from slowapi.util import get_remote_address 
 from slowapi.errors import RateLimitExceeded
@@ -6,6 +9,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 from .config import JWT_SECRET_KEY
+from .db import PoolTimeoutError, db_pool, shutdown_db_executor
+from .jobs import job_workers
+from .metrics import CONTENT_TYPE, REGISTRY
 from .routers import (
     auth_router,
     agent_router,
@@ -20,16 +26,33 @@ from .routers import (
 
 limiter = Limiter(key_func=get_remote_address, default_limits=["10/second"])
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Worker chạy job sinh câu hỏi nền (/agent/jobs)
+    await job_workers.start()
+    yield
+    await job_workers.stop()
+    shutdown_db_executor()
+    db_pool.close()
+
 app = FastAPI(
     title="Ultimate MCQs Agent",
     version="2.0.0",
-    description="AI Agent for generating and managing MCQs from text or audio."
+    description="AI Agent for generating and managing MCQs from text or audio.",
+    lifespan=lifespan,
 )
 
 
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+@app.exception_handler(PoolTimeoutError)
+async def db_pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    # Pool DB đã dùng hết: báo client thử lại thay vì 500
+    print(f"⚠️  {exc}")
+    return JSONResponse(status_code=503, content={"detail": "Máy chủ đang bận, vui lòng thử lại."},
+                        headers={"Retry-After": "1"})
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://bnson.id.vn"],
@@ -52,6 +75,14 @@ app.add_middleware(ProxyHeadersMiddleware, trusted_hosts="*")
 async def health():
     return {"status": "ok", "description": "Ultimate MCQ Agent is running"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Metrics của process này theo định dạng text của Prometheus."""
+    # render() gọi các gauge set_function (job_store.counts đọc SQLite): chạy ngoài event loop,
+    # và không qua executor DB để /metrics vẫn trả lời khi executor đó đang nghẽn
+    content = await asyncio.to_thread(REGISTRY.render)
+    return Response(content=content, media_type=CONTENT_TYPE)
+
 app.include_router(auth_router.router)
 app.include_router(agent_router.router)
 app.include_router(questions_router.router)
@@ -0,0 +1,243 @@
+"""Metrics dạng Prometheus (text exposition format 0.0.4), không cần thư viện ngoài.
+
+Counter / Gauge / Histogram có label, đăng ký vào REGISTRY và được xuất ở GET /metrics.
+Số liệu tính theo từng process: chạy nhiều worker uvicorn thì Prometheus scrape từng worker.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Bucket mặc định (giây) phù hợp với các bước gọi LLM (chậm)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+# Bucket cho các thao tác nhanh (DB, cache, trích xuất file nhỏ)
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: cần đúng các label {self.labelnames}, nhận {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def set_function(self, func: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        """Giá trị được tính lúc scrape: func() trả về {tuple label values: value}."""
+        self._function = func
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                values = self._function()
+            except Exception as e:
+                print(f"⚠️  Lỗi đọc metric {self.name}: {e}")
+                values = {}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in sorted(values.items())]
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} đã được đăng ký.")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+# ===== Pipeline =====
+STAGE_DURATION = histogram(
+    "mcq_stage_duration_seconds", "Thời gian từng bước của pipeline agent.", ["stage", "outcome"]
+)
+EXTRACTION_DURATION = histogram(
+    "mcq_extraction_duration_seconds", "Thời gian trích xuất + làm sạch text theo loại file.",
+    ["file_type", "outcome"], FAST_BUCKETS,
+)
+EXTRACTION_BYTES = counter(
+    "mcq_extraction_bytes_total", "Tổng số byte file đã trích xuất theo loại file.", ["file_type"]
+)
+
+# ===== Gemini =====
+LLM_REQUESTS = counter(
+    "gemini_requests_total", "Số request Gemini theo tác vụ, model và kết quả.", ["task", "model", "outcome"]
+)
+LLM_DURATION = histogram(
+    "gemini_request_duration_seconds", "Thời gian một request Gemini (không tính thời gian chờ semaphore).",
+    ["task", "model"],
+)
+LLM_TOKENS = counter(
+    "gemini_tokens_total", "Số token Gemini theo loại (prompt / candidates / thoughts).", ["task", "model", "kind"]
+)
+LLM_RETRIES = counter(
+    "gemini_retries_total", "Số lần gọi lại Gemini sau khi kết quả lỗi / thiếu.", ["task"]
+)
+LLM_IN_FLIGHT = gauge("gemini_requests_in_flight", "Số request Gemini đang chạy.")
+LLM_WAITING = gauge("gemini_requests_waiting", "Số request Gemini đang chờ semaphore (bão hòa).")
+LLM_CONCURRENCY_LIMIT = gauge("gemini_concurrency_limit", "Giới hạn request Gemini đồng thời mỗi process.")
+
+# ===== Cache =====
+CACHE_REQUESTS = counter(
+    "mcq_cache_requests_total", "Số lần tra cache theo cache, stage và kết quả (hit/miss).",
+    ["cache", "stage", "result"],
+)
+
+# ===== Database =====
+DB_QUERY_DURATION = histogram(
+    "mcq_db_query_duration_seconds", "Thời gian thao tác DB theo tên thao tác.", ["operation", "outcome"],
+    FAST_BUCKETS,
+)
+DB_POOL_CONNECTIONS = gauge(
+    "mcq_db_pool_connections", "Kết nối trong pool DB theo trạng thái (size/open/idle/in_use/waiting).", ["state"]
+)
+DB_POOL_WAIT = histogram("mcq_db_pool_wait_seconds", "Thời gian chờ mượn kết nối từ pool DB.", [], FAST_BUCKETS)
+DB_POOL_EVENTS = counter(
+    "mcq_db_pool_events_total",
+    "Sự kiện pool DB: connect, timeout, ping_failure, recycled, broken, leaked.", ["event"],
+)
+
+# ===== Jobs =====
+JOBS_FINISHED = counter("mcq_jobs_finished_total", "Số lần chạy job theo loại và kết quả.", ["kind", "outcome"])
+JOB_QUEUE = gauge("mcq_jobs", "Số job trong hàng đợi theo trạng thái.", ["status"])
+
+# ===== Process pools =====
+POOL_BUSY = gauge("mcq_pool_busy", "Số tác vụ đang chạy trong pool.", ["pool"])
+POOL_SIZE = gauge("mcq_pool_size", "Kích thước pool.", ["pool"])
@@ -1,33 +1,70 @@
 from fastapi import APIRouter, UploadFile, Form, HTTPException, Body, Depends
-import os, json, tempfile
-from typing import Any, Dict
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+import asyncio, os, json, shutil, tempfile
+from typing import Any, Dict, List, Optional
 from ..agent import Agent, SummaryMode
-from ..db import call_sp_save_file, call_sp_save_question_with_eval, get_connection
+from ..config import BATCH_MAX_PARALLEL_FILES, CHUNK_SIZE_CHARS, MAX_AUDIO_FILE_SIZE_MB
+from ..cache import question_counts
+from ..jobs import job_store, job_workers
+from ..db import (
+    fetch_existing_questions,
+    fetch_previous_version,
+    run_db,
+    run_in_db_executor,
+    save_agent_result_bulk,
+)
 from .auth_router import get_current_user
+from ..utils import chunk_hash, split_text_content_defined, stream_upload
 from ..tools import (
+    EVAL_CACHE,
+    extract_and_clean_from_path,
     extract_and_clean_from_uploadfile,
-    extract_text_from_audio_with_gemini,
-    extract_transcript_from_audio_with_gemini,
+    process_audio_with_gemini,
+    read_batch_uploads,
 )
 
 router = APIRouter(prefix="/agent", tags=["Agent"])
 
 agent = Agent()
 
+async def _previous_version(source_file_id: Optional[int], user_id: int):
+    """
+    Với file đã lưu (source_file_id): (câu hỏi đã có — để lọc gần trùng,
+    bản trước theo chunk — để chạy incremental hoặc None).
+    """
+    if source_file_id is None:
+        return [], None
+    existing, previous = await asyncio.gather(
+        run_db(fetch_existing_questions, source_file_id, user_id),
+        run_db(fetch_previous_version, source_file_id, user_id),
+    )
+    return existing, previous
+
 @router.post("/text")
 async def run_agent_text(
     file: UploadFile,
     num_questions: int = Form(5),
     summary_mode: SummaryMode = Form(SummaryMode.AUTO),
+    source_file_id: Optional[int] = Form(None),
     user=Depends(get_current_user)
 ):
-    """Extract text from document -> summarize + generate questions."""
+    """
+    Extract text from document -> summarize + generate questions.
+    source_file_id (tùy chọn): bản đã lưu trước đó của tài liệu này — bỏ các câu hỏi gần trùng
+    với câu đã có, và chỉ sinh câu hỏi cho phần văn bản đã thay đổi (dùng lại câu hỏi của
+    phần không đổi). Gửi kèm source_file_id khi /agent/save để cập nhật đúng file đó.
+    """
     try:
         ok, text = await extract_and_clean_from_uploadfile(file)
         if not ok:
             raise HTTPException(status_code=400, detail=text)
 
-        result = agent.decide_and_run(text, num_questions=num_questions, summary_mode=summary_mode)
+        existing, previous = await _previous_version(source_file_id, user["user_id"])
+        result = await agent.decide_and_run(
+            text, num_questions=num_questions, summary_mode=summary_mode,
+            existing_questions=existing, previous=previous,
+        )
         filename = file.filename
         suffix = os.path.splitext(filename)[1].lower().lstrip(".") or "txt"
         file_type = suffix.upper()
@@ -47,6 +84,8 @@ async def run_agent_text(
             "raw_text": text,
             "summary": summary,
             "questions": questions,
+            "duplicates_dropped": result.get("duplicates_dropped", 0) if isinstance(result, dict) else 0,
+            "source_file_id": source_file_id,
             "mode": mode
         }
 
@@ -64,16 +103,28 @@ async def run_agent_audio(
     user=Depends(get_current_user)
 ):
     """Process audio: transcribe -> summarize -> generate MCQs."""
+    tmp_path = None
     try:
         suffix = os.path.splitext(file.filename)[1].lower()
         file_type = suffix.lstrip(".").upper() or "AUDIO"
 
+        # Ghi thẳng ra file tạm theo từng khối, từ chối ngay khi vượt giới hạn
         with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(await file.read())
             tmp_path = tmp.name
+            ok, msg = await stream_upload(file, tmp, MAX_AUDIO_FILE_SIZE_MB)
+        if not ok:
+            os.remove(tmp_path)
+            raise HTTPException(status_code=400, detail=msg)
 
-        # get transcript
-        transcript = extract_transcript_from_audio_with_gemini(tmp_path)
+        # get transcript (+ summary directly from audio) — upload 1 lần, 2 prompt chạy song song
+        with_summary = summary_mode == SummaryMode.AUTO or summary_mode == SummaryMode.FORCE
+        if with_summary:
+            print(f"Chế độ {summary_mode}, đang tóm tắt audio...")
+        else:
+            # Nếu summary_mode == NONE, bỏ qua hoàn toàn
+            print(f"Chế độ {summary_mode}, bỏ qua tóm tắt audio.")
+
+        transcript, summary_from_audio = await process_audio_with_gemini(tmp_path, with_summary=with_summary)
         if transcript and transcript.startswith("[Lỗi"):
             os.remove(tmp_path)
             raise HTTPException(status_code=500, detail=transcript)
@@ -81,23 +132,12 @@ async def run_agent_audio(
             os.remove(tmp_path)
             raise HTTPException(status_code=400, detail="Empty transcript.")
 
-        summary_from_audio = None
-
-        # get summary directly from audio
-        if summary_mode == SummaryMode.AUTO or summary_mode == SummaryMode.FORCE:
-            print(f"Chế độ {summary_mode}, đang tóm tắt audio...")
-            
-            summary_from_audio = extract_text_from_audio_with_gemini(tmp_path)
-            
-            if summary_from_audio and summary_from_audio.startswith("[Lỗi"):
-                print(f"Audio summary error: {summary_from_audio}")
-                summary_from_audio = None # Xử lý nếu tóm tắt lỗi
-        else:
-            # Nếu summary_mode == NONE, bỏ qua hoàn toàn
-            print(f"Chế độ {summary_mode}, bỏ qua tóm tắt audio.")
+        if summary_from_audio and summary_from_audio.startswith("[Lỗi"):
+            print(f"Audio summary error: {summary_from_audio}")
+            summary_from_audio = None # Xử lý nếu tóm tắt lỗi
 
         # generate questions
-        result = agent.decide_and_run(
+        result = await agent.decide_and_run(
             transcript,
             num_questions=num_questions,
             summary_mode=summary_mode,
@@ -133,81 +173,395 @@ async def run_agent_audio(
     except HTTPException:
         raise
     except Exception as e:
-        os.remove(tmp_path)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
+        raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
+
+def _sse_response(produce, background: Optional[BackgroundTask] = None) -> StreamingResponse:
+    """
+    Chạy `produce(emit)` trong một task riêng và stream từng sự kiện `emit(event, data)`
+    cho client theo định dạng Server-Sent Events ngay khi nó xảy ra.
+    Client ngắt kết nối → task bị hủy. `background` (dọn file tạm) chạy khi response kết thúc.
+    """
+    async def stream():
+        queue = asyncio.Queue()
+
+        async def emit(event: str, data: dict):
+            await queue.put((event, data))
+
+        async def run():
+            try:
+                await produce(emit)
+            except HTTPException as e:
+                await emit("error", {"status_code": e.status_code, "detail": e.detail})
+            except Exception as e:
+                print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}")
+                await emit("error", {"status_code": 500, "detail": "Đã xảy ra lỗi máy chủ nội bộ."})
+            finally:
+                await queue.put(None)
+
+        task = asyncio.ensure_future(run())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                event, data = item
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        finally:
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background,
+    )
+
+@router.post("/text/stream")
+async def run_agent_text_stream(
+    file: UploadFile,
+    num_questions: int = Form(5),
+    summary_mode: SummaryMode = Form(SummaryMode.AUTO),
+    source_file_id: Optional[int] = Form(None),
+    user=Depends(get_current_user)
+):
+    """
+    Như /agent/text nhưng trả về Server-Sent Events:
+    "document" (raw_text) → "stage" / "summary" / "question" (từng câu đã chấm) → "done" hoặc "error".
+    """
+    try:
+        ok, text = await extract_and_clean_from_uploadfile(file)
+        if not ok:
+            raise HTTPException(status_code=400, detail=text)
+        existing, previous = await _previous_version(source_file_id, user["user_id"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
+        raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
+
+    filename = file.filename
+    suffix = os.path.splitext(filename)[1].lower().lstrip(".") or "txt"
+
+    async def produce(emit):
+        await emit("document", {"filename": filename, "file_type": suffix.upper(), "raw_text": text})
+        result = await agent.decide_and_run(
+            text, num_questions=num_questions, summary_mode=summary_mode, on_event=emit,
+            existing_questions=existing, previous=previous,
+        )
+        await emit("done", {
+            "mode": result.get("mode"),
+            "summary": result.get("summary"),
+            "total_questions": len(result.get("questions", []) or []),
+            "duplicates_dropped": result.get("duplicates_dropped", 0),
+            "source_file_id": source_file_id,
+        })
+
+    return _sse_response(produce)
+
+@router.post("/audio/stream")
+async def run_agent_audio_stream(
+    file: UploadFile,
+    num_questions: int = Form(5),
+    summary_mode: SummaryMode = Form(SummaryMode.AUTO),
+    user=Depends(get_current_user)
+):
+    """Như /agent/audio nhưng trả về Server-Sent Events (xem /agent/text/stream)."""
+    tmp_path = None
+    try:
+        suffix = os.path.splitext(file.filename)[1].lower()
+        file_type = suffix.lstrip(".").upper() or "AUDIO"
+
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+            tmp_path = tmp.name
+            ok, msg = await stream_upload(file, tmp, MAX_AUDIO_FILE_SIZE_MB)
+        if not ok:
+            os.remove(tmp_path)
+            raise HTTPException(status_code=400, detail=msg)
+    except HTTPException:
+        raise
+    except Exception as e:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
+        raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
+
+    filename = file.filename
+    with_summary = summary_mode == SummaryMode.AUTO or summary_mode == SummaryMode.FORCE
+
+    async def produce(emit):
+        await emit("stage", {"stage": "transcribe", "status": "started"})
+        transcript, summary_from_audio = await process_audio_with_gemini(tmp_path, with_summary=with_summary)
+        await emit("stage", {"stage": "transcribe", "status": "done"})
+
+        if transcript and transcript.startswith("[Lỗi"):
+            raise HTTPException(status_code=500, detail=transcript)
+        if not transcript:
+            raise HTTPException(status_code=400, detail="Empty transcript.")
+        if summary_from_audio and summary_from_audio.startswith("[Lỗi"):
+            print(f"Audio summary error: {summary_from_audio}")
+            summary_from_audio = None
+
+        await emit("document", {"filename": filename, "file_type": file_type, "raw_text": transcript})
+        if summary_from_audio:
+            await emit("summary", {"summary": summary_from_audio, "source": "audio"})
+
+        result = await agent.decide_and_run(
+            transcript, num_questions=num_questions, summary_mode=summary_mode, on_event=emit
+        )
+        summary_from_agent = result.get("summary")
+        await emit("done", {
+            "mode": result.get("mode"),
+            "summary": summary_from_agent if summary_from_agent else summary_from_audio,
+            "total_questions": len(result.get("questions", []) or []),
+        })
+
+    # File tạm bị xóa khi response kết thúc, kể cả khi client ngắt kết nối trước khi stream chạy
+    return _sse_response(produce, background=BackgroundTask(os.remove, tmp_path))
+
+async def _run_batch_document(entry: dict, num_questions: int, summary_mode: SummaryMode, limiter) -> dict:
+    """Trích xuất + sinh câu hỏi cho một tài liệu trong batch; lỗi chỉ ảnh hưởng tài liệu đó."""
+    filename = entry["filename"]
+    if "error" in entry:
+        return {"filename": filename, "error": entry["error"]}
+    try:
+        ok, text = await extract_and_clean_from_path(filename, entry["path"])
+        if not ok:
+            return {"filename": filename, "error": text}
+
+        # Trích xuất chạy song song thoải mái, còn phần gọi Gemini thì giới hạn số tài liệu cùng lúc
+        async with limiter:
+            result = await agent.decide_and_run(text, num_questions=num_questions, summary_mode=summary_mode)
+
+        suffix = os.path.splitext(filename)[1].lower().lstrip(".") or "txt"
+        return {
+            "filename": filename,
+            "file_type": suffix.upper(),
+            "raw_text": text,
+            "summary": result.get("summary"),
+            "questions": result.get("questions", []) or [],
+            "mode": result.get("mode"),
+        }
+    except Exception as e:
+        print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {filename}: {e}")
+        return {"filename": filename, "error": "Đã xảy ra lỗi máy chủ nội bộ."}
+
+async def _read_batch(files: List[UploadFile], workdir: str) -> list:
+    try:
+        ok, entries = await read_batch_uploads(files, workdir)
+    except Exception as e:
         print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
+    if not ok:
+        raise HTTPException(status_code=400, detail=entries)
+    return entries
+
+@router.post("/batch")
+async def run_agent_batch(
+    files: List[UploadFile],
+    num_questions: int = Form(5),
+    summary_mode: SummaryMode = Form(SummaryMode.AUTO),
+    user=Depends(get_current_user)
+):
+    """
+    Nhiều tài liệu (PDF/DOCX/TXT và/hoặc file ZIP chứa chúng) trong một request.
+    Mỗi tài liệu được xử lý như /agent/text (num_questions câu mỗi tài liệu), các tài liệu
+    chạy song song; kết quả trả về theo đúng thứ tự tài liệu.
+    """
+    with tempfile.TemporaryDirectory(prefix="mcq-batch-") as workdir:
+        entries = await _read_batch(files, workdir)
+        limiter = asyncio.Semaphore(BATCH_MAX_PARALLEL_FILES)
+        results = await asyncio.gather(
+            *(_run_batch_document(entry, num_questions, summary_mode, limiter) for entry in entries)
+        )
+    failed = sum(1 for r in results if "error" in r)
+    return {"files": results, "succeeded": len(results) - failed, "failed": failed}
+
+@router.post("/batch/stream")
+async def run_agent_batch_stream(
+    files: List[UploadFile],
+    num_questions: int = Form(5),
+    summary_mode: SummaryMode = Form(SummaryMode.AUTO),
+    user=Depends(get_current_user)
+):
+    """
+    Như /agent/batch nhưng trả về Server-Sent Events: "batch" (danh sách tài liệu),
+    rồi "file" cho từng tài liệu ngay khi nó xong (kèm "index"), cuối cùng "done".
+    """
+    # Tài liệu đã spool ra đĩa: xóa khi stream kết thúc (kể cả khi client ngắt kết nối)
+    workdir = tempfile.mkdtemp(prefix="mcq-batch-")
+    try:
+        entries = await _read_batch(files, workdir)
+    except BaseException:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+
+    async def produce(emit):
+        await emit("batch", {"files": [entry["filename"] for entry in entries]})
+        limiter = asyncio.Semaphore(BATCH_MAX_PARALLEL_FILES)
+
+        async def run(index: int, entry: dict):
+            result = await _run_batch_document(entry, num_questions, summary_mode, limiter)
+            await emit("file", {"index": index, **result})
+            return "error" not in result
+
+        outcomes = await asyncio.gather(*(run(i, entry) for i, entry in enumerate(entries)))
+        succeeded = sum(outcomes)
+        await emit("done", {"succeeded": succeeded, "failed": len(outcomes) - succeeded})
+
+    return _sse_response(produce, background=BackgroundTask(shutil.rmtree, workdir, ignore_errors=True))
+
+@router.post("/jobs", status_code=202)
+async def submit_agent_job(
+    file: UploadFile,
+    num_questions: int = Form(5),
+    summary_mode: SummaryMode = Form(SummaryMode.AUTO),
+    source_file_id: Optional[int] = Form(None),
+    user=Depends(get_current_user)
+):
+    """
+    Như /agent/text nhưng chạy nền: trích xuất text rồi trả về job_id ngay.
+    Theo dõi tiến trình / lấy kết quả qua GET /agent/jobs/{job_id}.
+    """
+    try:
+        ok, text = await extract_and_clean_from_uploadfile(file)
+        if not ok:
+            raise HTTPException(status_code=400, detail=text)
+
+        # Chụp câu hỏi đã có / bản trước lúc submit: lần chạy lại (retry) dùng cùng dữ liệu
+        existing, previous = await _previous_version(source_file_id, user["user_id"])
+        filename = file.filename
+        suffix = os.path.splitext(filename)[1].lower().lstrip(".") or "txt"
+        job_id = await job_workers.submit(user["user_id"], "text", {
+            "filename": filename,
+            "file_type": suffix.upper(),
+            "text": text,
+            "num_questions": num_questions,
+            "summary_mode": summary_mode.value,
+            "existing_questions": existing,
+            "previous": previous,
+            "source_file_id": source_file_id,
+        })
+        return {"job_id": job_id, "status": "queued"}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
+        raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
+
+@router.get("/jobs/{job_id}")
+async def get_agent_job(job_id: str, user=Depends(get_current_user)):
+    """Trạng thái (queued/running/succeeded/failed), tiến trình và kết quả của một job."""
+    try:
+        job = await run_in_db_executor(job_store.get, job_id, user["user_id"])
+    except Exception as e:
+        print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
+        raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job.")
+
+    result = job["result"]
+    if result is not None:
+        # Cùng dạng với response của /agent/text để gửi thẳng sang /agent/save
+        result = {**result, "raw_text": job["payload"].get("text")}
+    return {
+        "job_id": job["job_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "result": result,
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
 
 @router.post("/save")
 async def save_agent_result(
     payload: Dict[str, Any] = Body(...),
     user=Depends(get_current_user)
 ):
-    """Save AI results (file + questions) to database."""
+    """
+    Save AI results (file + questions) to database.
+    Có source_file_id (kết quả re-upload): cập nhật file đó thay vì tạo file mới; các câu hỏi
+    dùng lại (đã có question_id) không được lưu lần nữa.
+    """
     try:
         filename = payload.get("filename")
         file_type = payload.get("file_type")
         raw_text = payload.get("raw_text")
         summary = payload.get("summary")
         questions = payload.get("questions", [])
+        source_file_id = payload.get("source_file_id")
         user_id = user["user_id"]
 
         if not all([filename, file_type, raw_text, user_id]):
             raise HTTPException(status_code=400, detail="Missing filename, file_type, raw_text or user info.")
 
-        filename_json_str = json.dumps(filename, ensure_ascii=False)
-        file_id = call_sp_save_file(
-            uploader_id=user_id,
-            filename=filename_json_str,
-            file_type=str(file_type)[:50],
-            storage_path=None,
-            raw_text=raw_text,
-            summary=summary
-        )
-        if not file_id:
-            raise HTTPException(status_code=500, detail="File save failed (no file_id).")
-
-        saved_count = 0
         if not isinstance(questions, list):
             questions = []
 
+        rows = []
+        reused_count = 0
         for q in questions:
             if not isinstance(q, dict):
                 continue
+            if source_file_id and q.get("question_id"):
+                # Câu hỏi dùng lại từ bản trước: đã nằm trong DB dưới file này
+                reused_count += 1
+                continue
 
             question_text = q.get("question") or q.get("question_text") or "Invalid question"
             options_list = q.get("options") or []
             answer_letter = q.get("answer_letter") or q.get("answer") or "?"
             status = q.get("status") or "need_review"
             eval_info = q.get("_eval_breakdown", {}) or {}
-            total_score = q.get("score", 0)
-            accuracy_score = eval_info.get("accuracy", 0)
-            alignment_score = eval_info.get("alignment", 0)
-            distractors_score = eval_info.get("distractors", 0)
-            clarity_score = eval_info.get("clarity", 0)
-            status_by_agent = q.get("status", "need_review")
-
-            call_sp_save_question_with_eval(
-                source_file_id=file_id,
-                creator_id=user_id,
-                question_text=json.dumps(question_text, ensure_ascii=False),
-                options_json=json.dumps(options_list, ensure_ascii=False),
-                answer_letter=str(answer_letter)[:1],
-                status=str(status)[:20],
-                model_version="gemini-2.5-flash",
-                total_score=int(total_score),
-                accuracy_score=int(accuracy_score),
-                alignment_score=int(alignment_score),
-                distractors_score=int(distractors_score),
-                clarity_score=int(clarity_score),
-                status_by_agent=status_by_agent,
-                raw_response_json=json.dumps(q, ensure_ascii=False)
-            )
-            saved_count += 1
+            rows.append({
+                "question_text": json.dumps(question_text, ensure_ascii=False),
+                "options_json": json.dumps(options_list, ensure_ascii=False),
+                "answer_letter": str(answer_letter)[:1],
+                "status": str(status)[:20],
+                "model_version": "gemini-2.5-flash",
+                "total_score": int(q.get("score", 0)),
+                "accuracy_score": int(eval_info.get("accuracy", 0)),
+                "alignment_score": int(eval_info.get("alignment", 0)),
+                "distractors_score": int(eval_info.get("distractors", 0)),
+                "clarity_score": int(eval_info.get("clarity", 0)),
+                "status_by_agent": q.get("status", "need_review"),
+                "raw_response_json": json.dumps(q, ensure_ascii=False),
+            })
+
+        # Hash từng chunk để lần upload lại sau chỉ phải sinh câu hỏi cho phần đã sửa
+        chunk_hashes = [chunk_hash(c) for c in split_text_content_defined(raw_text, CHUNK_SIZE_CHARS)]
+
+        # File + chunk + mọi câu hỏi/đánh giá: một kết nối, một giao dịch
+        file_id = await run_db(
+            save_agent_result_bulk,
+            uploader_id=user_id,
+            filename=json.dumps(filename, ensure_ascii=False),
+            file_type=str(file_type)[:50],
+            raw_text=raw_text,
+            summary=summary,
+            questions=rows,
+            chunk_hashes=chunk_hashes,
+            source_file_id=int(source_file_id) if source_file_id else None,
+        )
+        if file_id is None:
+            raise HTTPException(status_code=404, detail="Không tìm thấy file.")
+        if not file_id:
+            raise HTTPException(status_code=500, detail="File save failed (no file_id).")
+        saved_count = len(rows)
+        question_counts.invalidate(user_id)
 
         return {
             "message": "✅ Data saved successfully.",
             "file_id": file_id,
-            "saved_questions": saved_count
+            "saved_questions": saved_count,
+            "reused_questions": reused_count
         }
 
     except HTTPException:
@@ -216,13 +570,20 @@ async def save_agent_result(
         print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     
+@router.get("/cache/stats")
+async def get_cache_stats(user=Depends(get_current_user)):
+    """Hit/miss/eviction counters of the in-memory evaluation cache (this worker only)."""
+    return {"evaluation_cache": EVAL_CACHE.stats()}
+
 @router.get("/files/my-list")
 async def get_my_files_list(user=Depends(get_current_user)):
     """
     Lấy danh sách TẤT CẢ các file (ID và Tên) mà user đã tải lên.
     (Đã xóa JOIN Questions và thêm try/except an toàn)
     """
-    conn = get_connection()
+    return await run_db(_get_my_files_list, user)
+
+def _get_my_files_list(conn, user):
     cur = conn.cursor(dictionary=True)
     try:
         user_id = user["user_id"]
@@ -258,4 +619,3 @@ async def get_my_files_list(user=Depends(get_current_user)):
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
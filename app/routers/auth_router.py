@@ -30,16 +30,19 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
              raise HTTPException(status_code=401, detail="Invalid token (no user_id).")
 
         conn = get_connection()
-        cur = conn.cursor(dictionary=True)
-        
-        # === LẤY TẤT CẢ THÔNG TIN MỚI TỪ DATABASE ===
-        cur.execute("""
-            SELECT user_id, username, email, full_name, phone_number, birth, is_active, is_admin
-            FROM Users 
-            WHERE user_id=%s
-        """, (user_id,))
-        user = cur.fetchone() # user bây giờ là full profile từ DB
-        cur.close(); conn.close()
+        try:
+            cur = conn.cursor(dictionary=True)
+
+            # === LẤY TẤT CẢ THÔNG TIN MỚI TỪ DATABASE ===
+            cur.execute("""
+                SELECT user_id, username, email, full_name, phone_number, birth, is_active, is_admin
+                FROM Users 
+                WHERE user_id=%s
+            """, (user_id,))
+            user = cur.fetchone() # user bây giờ là full profile từ DB
+            cur.close()
+        finally:
+            conn.close()
         # === KẾT THÚC SỬA ===
 
         if not user:
@@ -86,11 +89,14 @@ def get_optional_current_user(token: Optional[str] = Depends(optional_oauth2_sch
             return None 
 
         conn = get_connection()
-        cur = conn.cursor(dictionary=True)
-        # SỬA LỖI ? -> %s
-        cur.execute("SELECT is_active FROM Users WHERE user_id=%s", (user_id,))
-        user_db = cur.fetchone()
-        cur.close(); conn.close()
+        try:
+            cur = conn.cursor(dictionary=True)
+            # SỬA LỖI ? -> %s
+            cur.execute("SELECT is_active FROM Users WHERE user_id=%s", (user_id,))
+            user_db = cur.fetchone()
+            cur.close()
+        finally:
+            conn.close()
 
         if not user_db or user_db["is_active"] == 0:
             return None 
@@ -104,26 +110,32 @@ def get_optional_current_user(token: Optional[str] = Depends(optional_oauth2_sch
 @limiter.limit("5/minute")
 def register(request: Request, username: str = Form(...), email: str = Form(...), password: str = Form(...)):
     conn = get_connection()
-    cur = conn.cursor()
-    # SỬA LỖI ? -> %s
-    cur.execute("SELECT 1 FROM Users WHERE username=%s OR email=%s", (username, email))
-    if cur.fetchone():
-        raise HTTPException(status_code=400, detail="Username hoặc email đã tồn tại")
-    hashed = hash_password(password)
-    # SỬA LỖI ? -> %s
-    cur.execute("INSERT INTO Users (username, email, password_hash, is_active) VALUES (%s, %s, %s, 1)",
-                (username, email, hashed))
-    conn.commit()
+    try:
+        cur = conn.cursor()
+        # SỬA LỖI ? -> %s
+        cur.execute("SELECT 1 FROM Users WHERE username=%s OR email=%s", (username, email))
+        if cur.fetchone():
+            raise HTTPException(status_code=400, detail="Username hoặc email đã tồn tại")
+        hashed = hash_password(password)
+        # SỬA LỖI ? -> %s
+        cur.execute("INSERT INTO Users (username, email, password_hash, is_active) VALUES (%s, %s, %s, 1)",
+                    (username, email, hashed))
+        conn.commit()
+    finally:
+        conn.close()
     return {"message": "Đăng ký thành công"}
 
 @router.post("/login")
 @limiter.limit("5/minute")
 def login(request: Request, username: str = Form(...), password: str = Form(...)):
     conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-    # SỬA LỖI ? -> %s
-    cur.execute("SELECT * FROM Users WHERE username=%s", (username,))
-    user = cur.fetchone()
+    try:
+        cur = conn.cursor(dictionary=True)
+        # SỬA LỖI ? -> %s
+        cur.execute("SELECT * FROM Users WHERE username=%s", (username,))
+        user = cur.fetchone()
+    finally:
+        conn.close()
     if not user or not verify_password(password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Sai tên đăng nhập hoặc mật khẩu")
     token = create_access_token({"sub": user["username"], "user_id": user["user_id"], "is_admin": user.get("is_admin", 0)})
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, Form
-from ..db import get_connection
+from ..cache import question_counts
+from ..db import run_db
 from .auth_router import get_current_user
 
 router = APIRouter(prefix="/evaluations", tags=["Evaluations"])
@@ -7,7 +8,10 @@ router = APIRouter(prefix="/evaluations", tags=["Evaluations"])
 @router.get("/{evaluation_id}")
 async def get_evaluation_detail(evaluation_id: int, user=Depends(get_current_user)):
     """Get a single evaluation."""
-    conn = get_connection(); cur = conn.cursor(dictionary=True)
+    return await run_db(_get_evaluation_detail, evaluation_id, user)
+
+def _get_evaluation_detail(conn, evaluation_id, user):
+    cur = conn.cursor(dictionary=True)
     try:
         cur.execute("""
             SELECT e.*, q.question_text, q.question_id
@@ -20,7 +24,7 @@ async def get_evaluation_detail(evaluation_id: int, user=Depends(get_current_use
             raise HTTPException(status_code=404, detail="Evaluation not found.")
         return row
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.put("/{evaluation_id}")
 async def update_evaluation(
@@ -34,7 +38,10 @@ async def update_evaluation(
     user=Depends(get_current_user)
 ):
     """Update evaluation scores."""
-    conn = get_connection(); cur = conn.cursor()
+    return await run_db(_update_evaluation, evaluation_id, total_score, accuracy_score, alignment_score, distractors_score, clarity_score, status_by_agent, user)
+
+def _update_evaluation(conn, evaluation_id, total_score, accuracy_score, alignment_score, distractors_score, clarity_score, status_by_agent, user):
+    cur = conn.cursor()
     try:
         cur.execute("""
             UPDATE QuestionEvaluations e
@@ -54,6 +61,7 @@ async def update_evaluation(
         ))
         affected_rows = cur.rowcount
         conn.commit()
+        question_counts.invalidate(user["user_id"])  # bộ lọc status của GET /questions
 
         if affected_rows == 0:
             cur.execute("""
@@ -70,12 +78,15 @@ async def update_evaluation(
         print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.delete("/{evaluation_id}")
 async def delete_evaluation(evaluation_id: int, user=Depends(get_current_user)):
     """Delete evaluation."""
-    conn = get_connection(); cur = conn.cursor()
+    return await run_db(_delete_evaluation, evaluation_id, user)
+
+def _delete_evaluation(conn, evaluation_id, user):
+    cur = conn.cursor()
     try:
         cur.execute("""
             DELETE e FROM QuestionEvaluations e
@@ -84,6 +95,7 @@ async def delete_evaluation(evaluation_id: int, user=Depends(get_current_user)):
         """, (evaluation_id, user["user_id"]))
         affected_rows = cur.rowcount
         conn.commit()
+        question_counts.invalidate(user["user_id"])  # bộ lọc status của GET /questions
 
         if affected_rows == 0:
             cur.execute("""
@@ -100,4 +112,4 @@ async def delete_evaluation(evaluation_id: int, user=Depends(get_current_user)):
         print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
-        cur.close(); conn.close()
+        cur.close()
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Form, Depends, HTTPException
-from ..db import get_connection
+from ..db import run_db
 from .auth_router import get_current_user
 import secrets
 
@@ -13,7 +13,10 @@ async def create_exam(
     user=Depends(get_current_user)
 ):
     # ... (code của bạn, đã dùng %s - ĐÚNG) ...
-    conn = get_connection(); cur = conn.cursor()
+    return await run_db(_create_exam, title, description, question_ids, user)
+
+def _create_exam(conn, title, description, question_ids, user):
+    cur = conn.cursor()
     try:
         ids = [int(x.strip()) for x in question_ids.split(",") if x.strip().isdigit()]
         share_token = secrets.token_hex(8)  # generate 16-char unique token
@@ -28,6 +31,17 @@ async def create_exam(
         """, (title, description, user["user_id"], share_token))
         exam_id = cur.lastrowid
 
+        # Bỏ các câu hỏi không tồn tại hoặc đã 'superseded' (chunk nguồn đã bị sửa khi re-upload)
+        if ids:
+            placeholders = ','.join(['%s'] * len(ids))
+            cur.execute(
+                f"SELECT question_id FROM Questions WHERE question_id IN ({placeholders})"
+                " AND COALESCE(status, '') <> 'superseded'",
+                tuple(ids),
+            )
+            valid = {row[0] for row in cur.fetchall()}
+            ids = [qid for qid in dict.fromkeys(ids) if qid in valid]
+
         # link questions
         for qid in ids:
             cur.execute("INSERT INTO ExamQuestions (exam_id, question_id) VALUES (%s, %s)", (exam_id, qid))
@@ -43,12 +57,15 @@ async def create_exam(
         print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.get("/")
 async def get_exams(user=Depends(get_current_user)):
     # ... (code của bạn, đã dùng %s - ĐÚNG) ...
-    conn = get_connection(); cur = conn.cursor(dictionary=True)
+    return await run_db(_get_exams, user)
+
+def _get_exams(conn, user):
+    cur = conn.cursor(dictionary=True)
     try:
         cur.execute("""
             SELECT exam_id, title, description, created_at
@@ -58,12 +75,15 @@ async def get_exams(user=Depends(get_current_user)):
         """, (user["user_id"],))
         return {"exams": cur.fetchall()}
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.get("/{exam_id}")
 async def get_exam_detail(exam_id: int, user=Depends(get_current_user)):
     # ... (code của bạn, đã dùng %s - ĐÚNG) ...
-    conn = get_connection(); cur = conn.cursor(dictionary=True)
+    return await run_db(_get_exam_detail, exam_id, user)
+
+def _get_exam_detail(conn, exam_id, user):
+    cur = conn.cursor(dictionary=True)
     try:
         cur.execute("SELECT * FROM Exams WHERE exam_id=%s AND owner_id=%s", (exam_id, user["user_id"]))
         exam = cur.fetchone()
@@ -73,17 +93,20 @@ async def get_exam_detail(exam_id: int, user=Depends(get_current_user)):
             SELECT q.question_id, q.question_text, q.options, q.answer_letter
             FROM ExamQuestions eq
             JOIN Questions q ON eq.question_id = q.question_id
-            WHERE eq.exam_id = %s
+            WHERE eq.exam_id = %s AND COALESCE(q.status, '') <> 'superseded'
         """, (exam_id,))
         exam["questions"] = cur.fetchall()
         return exam
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.delete("/{exam_id}")
 async def delete_exam(exam_id: int, user=Depends(get_current_user)):
     # ... (code của bạn, đã dùng %s - ĐÚNG) ...
-    conn = get_connection(); cur = conn.cursor()
+    return await run_db(_delete_exam, exam_id, user)
+
+def _delete_exam(conn, exam_id, user):
+    cur = conn.cursor()
     try:
         cur.execute("DELETE FROM Exams WHERE exam_id=%s AND owner_id=%s", (exam_id, user["user_id"]))
         affected = cur.rowcount
@@ -92,7 +115,7 @@ async def delete_exam(exam_id: int, user=Depends(get_current_user)):
             raise HTTPException(status_code=404, detail="Exam not found.")
         return {"message": "🗑️ Exam deleted successfully."}
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.get("/token/{share_token}")
 async def get_exam_by_token(share_token: str):
@@ -101,7 +124,10 @@ async def get_exam_by_token(share_token: str):
     dùng cho trang làm bài công khai (public).
     Endpoint này KHÔNG cần xác thực.
     """
-    conn = get_connection(); cur = conn.cursor(dictionary=True)
+    return await run_db(_get_exam_by_token, share_token)
+
+def _get_exam_by_token(conn, share_token):
+    cur = conn.cursor(dictionary=True)
     try:
         cur.execute(
             "SELECT exam_id, title, description FROM Exams WHERE share_token = %s",
@@ -112,7 +138,7 @@ async def get_exam_by_token(share_token: str):
             raise HTTPException(status_code=404, detail="Không tìm thấy đề thi.")
         return exam
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.get("/{exam_id}/results")
 async def get_exam_results_by_owner(
@@ -123,7 +149,9 @@ async def get_exam_results_by_owner(
     [Dành cho chủ sở hữu] Lấy tất cả kết quả (sessions) 
     của một đề thi cụ thể.
     """
-    conn = get_connection()
+    return await run_db(_get_exam_results_by_owner, exam_id, user)
+
+def _get_exam_results_by_owner(conn, exam_id, user):
     cur = conn.cursor(dictionary=True)
     try:
         user_id = user["user_id"]
@@ -161,4 +189,3 @@ async def get_exam_results_by_owner(
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
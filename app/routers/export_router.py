@@ -4,7 +4,7 @@ from fastapi import APIRouter, Response
 from pydantic import BaseModel, Field
 from weasyprint import HTML
 from fastapi import Depends, HTTPException
-from ..db import get_connection
+from ..db import get_db
 import re
 from .auth_router import get_current_user
 
@@ -93,7 +93,7 @@ def format_mcqs_to_html(exam_title: str, questions: List[dict]) -> str:
 )
 def export_to_pdf(
     data: PDFExportRequest,
-    conn=Depends(get_connection), # <-- Thêm kết nối DB
+    conn=Depends(get_db), # <-- Mượn kết nối từ pool, tự trả về khi request xong
     user: dict = Depends(get_current_user)
 ):
     """
@@ -119,7 +119,7 @@ def export_to_pdf(
             SELECT q.question_id, q.question_text, q.options, q.answer_letter
             FROM ExamQuestions eq
             JOIN Questions q ON eq.question_id = q.question_id
-            WHERE eq.exam_id = %s
+            WHERE eq.exam_id = %s AND COALESCE(q.status, '') <> 'superseded'
         """, (data.exam_id,))
         
         questions = cur.fetchall()
@@ -167,5 +167,4 @@ def export_to_pdf(
         print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
-        cur.close()
-        conn.close() # <-- Luôn đóng kết nối
\ No newline at end of file
+        cur.close()
\ No newline at end of file
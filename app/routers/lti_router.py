@@ -16,7 +16,7 @@ from pylti1p3.request import Request as PyltiRequest
 from fastapi.responses import Response
 
 # Import từ các file hiện có của bạn
-from ..db import get_connection
+from ..db import run_db
 from ..config import (
     APP_BASE_URL, LTI_CLIENT_ID, LTI_DEPLOYMENT_ID, LTI_AUTH_LOGIN_URL,
     LTI_AUTH_TOKEN_URL, LTI_KEY_SET_URL, LTI_PRIVATE_KEY_FILE, LTI_PUBLIC_KEY_FILE,
@@ -234,6 +234,17 @@ def create_lti_session(conn: Connection, exam_id: int, user_id: int, lti_data: d
     cur.close()
     return session_id
 
+def create_lti_session_for_token(conn: Connection, exam_share_token: str, user_id: int, lti_data: dict) -> int:
+    """Tìm đề thi theo share_token rồi tạo phiên làm bài LTI (404 nếu không có đề)."""
+    cur = conn.cursor(dictionary=True)
+    cur.execute("SELECT exam_id FROM Exams WHERE share_token = %s", (exam_share_token,))
+    exam = cur.fetchone()
+    cur.close()
+
+    if not exam:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy Exam với token: {exam_share_token}")
+    return create_lti_session(conn, exam['exam_id'], user_id, lti_data)
+
 # =========================================================================
 # === 3. CÁC ENDPOINTS LTI (ĐÃ SỬA) ===
 # =========================================================================
@@ -297,7 +308,7 @@ async def lti_login(request: Request):
 # [FILE: lti_router.py]
 
 @router.post("/launch")
-async def lti_launch(request: Request, conn=Depends(get_connection)):
+async def lti_launch(request: Request):
     """
     Endpoint (Công khai) - Phiên bản chuẩn, đã bỏ debug gây lỗi.
     """
@@ -330,7 +341,7 @@ async def lti_launch(request: Request, conn=Depends(get_connection)):
         # -------------------------------------------------------------
         
         # A. Xác định và cấp phép User (SSO)
-        user = get_or_create_lti_user(conn, lti_data)
+        user = await run_db(get_or_create_lti_user, lti_data)
         user_id = user["user_id"]
         
         # B. Tạo JWT Token
@@ -358,16 +369,8 @@ async def lti_launch(request: Request, conn=Depends(get_connection)):
             # Fallback về Dashboard nếu giáo viên quên gắn token
             return RedirectResponse(url=f"{REACT_BASE_URL}/dashboard?token={access_token}",status_code=303)
             
-        cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT exam_id FROM Exams WHERE share_token = %s", (exam_share_token,))
-        exam = cur.fetchone()
-        cur.close()
-        
-        if not exam:
-            raise HTTPException(status_code=404, detail=f"Không tìm thấy Exam với token: {exam_share_token}")
-        
         # 5. Tạo Session
-        session_id = create_lti_session(conn, exam['exam_id'], user_id, lti_data)
+        session_id = await run_db(create_lti_session_for_token, exam_share_token, user_id, lti_data)
         
         # 6. Chuyển hướng về Frontend làm bài
         redirect_url = f"{REACT_BASE_URL}/session/{session_id}?token={access_token}"
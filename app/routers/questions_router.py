@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, Form, Path
-from ..db import get_connection
+import base64, hashlib, json
+from ..cache import question_counts
+from ..db import run_db
 from .auth_router import get_current_user
-from datetime import date  # <-- THÊM MỚI: Để xử lý lọc theo ngày
+from datetime import date, timedelta  # <-- THÊM MỚI: Để xử lý lọc theo ngày
 
 router = APIRouter(prefix="/questions", tags=["Questions"])
 
@@ -9,6 +11,54 @@ router = APIRouter(prefix="/questions", tags=["Questions"])
 # === HÀM GET /QUESTIONS ĐÃ ĐƯỢC NÂNG CẤP TOÀN DIỆN ===
 # =========================================================================
 
+# Thứ tự sắp xếp dùng cho cả ORDER BY lẫn phân trang keyset (cursor).
+# question_id luôn đứng cuối để thứ tự là duy nhất (không trùng / sót dòng giữa hai trang).
+_SORT_KEYS = {
+    "newest": [("created_at", "DESC"), ("question_id", "DESC")],
+    "oldest": [("created_at", "ASC"), ("question_id", "ASC")],
+    "score_high": [("score", "DESC"), ("created_at", "DESC"), ("question_id", "DESC")],
+    "score_low": [("score", "ASC"), ("created_at", "DESC"), ("question_id", "DESC")],
+}
+_SORT_COLUMNS = {
+    "created_at": "q.created_at",
+    "question_id": "q.question_id",
+    # Câu chưa có đánh giá (NULL) xếp như điểm -1, giống thứ tự NULL của MariaDB
+    "score": "COALESCE(e.total_score, -1)",
+}
+
+def _sort_value(row: dict, name: str):
+    if name == "score":
+        return -1 if row["total_score"] is None else row["total_score"]
+    if name == "created_at":
+        return str(row["created_at"])
+    return row[name]
+
+def _encode_cursor(sort_by: str, filter_key: str, row: dict) -> str:
+    values = [_sort_value(row, name) for name, _ in _SORT_KEYS[sort_by]]
+    raw = json.dumps({"s": sort_by, "f": filter_key, "k": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str, sort_by: str, filter_key: str) -> list:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values = data["k"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor không hợp lệ.")
+    if data.get("s") != sort_by or data.get("f") != filter_key or len(values) != len(_SORT_KEYS[sort_by]):
+        raise HTTPException(status_code=400, detail="cursor không khớp với bộ lọc hoặc cách sắp xếp hiện tại.")
+    return values
+
+def _keyset_clause(sort_by: str, values: list):
+    """(k1 < v1) OR (k1 = v1 AND k2 < v2) OR ... — '>' cho khóa ASC."""
+    keys = _SORT_KEYS[sort_by]
+    clauses, params = [], []
+    for i, (name, direction) in enumerate(keys):
+        parts = [f"{_SORT_COLUMNS[prev]} = %s" for prev, _ in keys[:i]]
+        parts.append(f"{_SORT_COLUMNS[name]} {'<' if direction == 'DESC' else '>'} %s")
+        clauses.append("(" + " AND ".join(parts) + ")")
+        params.extend(values[:i + 1])
+    return "(" + " OR ".join(clauses) + ")", params
+
 @router.get("/")
 async def get_questions_advanced(
     # --- Xác thực ---
@@ -26,16 +76,31 @@ async def get_questions_advanced(
     
     # === THAM SỐ PHÂN TRANG MỚI ===
     page: int = 1,
-    page_size: int = 10  # <-- Số lượng hợp lý bạn yêu cầu
+    page_size: int = 10,  # <-- Số lượng hợp lý bạn yêu cầu
+
+    # === PHÂN TRANG KEYSET ===
+    cursor: str | None = None,  # next_cursor của trang trước; có cursor thì bỏ qua `page`
+    include_total: bool = True,  # False: không đếm tổng (total_count = None)
 ):
     """
     Nâng cấp: Lấy câu hỏi với hệ thống lọc, tìm kiếm, sắp xếp
     VÀ PHÂN TRANG.
+    Hai cách phân trang: theo `page` (OFFSET, như cũ) hoặc theo `cursor` = `next_cursor`
+    của trang trước (keyset — trang thứ bao nhiêu cũng chỉ đọc page_size dòng).
+    total_count được cache theo (user, bộ lọc) trong QUESTION_COUNT_CACHE_SECONDS giây.
     """
-    conn = get_connection()
+    return await run_db(_get_questions_advanced, user, search_term, search_in_question, search_in_options, file_id, status, start_date, end_date, sort_by, page, page_size, cursor, include_total)
+
+def _get_questions_advanced(conn, user, search_term, search_in_question, search_in_options, file_id, status, start_date, end_date, sort_by, page, page_size, cursor, include_total):
     cur = conn.cursor(dictionary=True)
     try:
         user_id = user["user_id"]
+        if sort_by not in _SORT_KEYS:
+            sort_by = "newest"
+        # Định danh bộ lọc: key của cache total_count và dấu kiểm của cursor
+        filter_key = hashlib.sha1(json.dumps(
+            [search_term, search_in_question, search_in_options, file_id, status, str(start_date), str(end_date)]
+        ).encode("utf-8")).hexdigest()[:16]
         
         # === 1. XÂY DỰNG CÁC MỆNH ĐỀ SQL ===
         
@@ -46,7 +111,8 @@ async def get_questions_advanced(
         """
         
         # Phần WHERE (Giữ nguyên)
-        where_clauses = ["q.creator_id = %s"]
+        # Câu hỏi 'superseded' (sinh từ chunk đã bị sửa khi re-upload) không còn nằm trong ngân hàng câu hỏi
+        where_clauses = ["q.creator_id = %s", "COALESCE(q.status, '') <> 'superseded'"]
         params = [user_id]
         
         if file_id:
@@ -55,12 +121,13 @@ async def get_questions_advanced(
         if status:
             where_clauses.append("e.status_by_agent = %s")
             params.append(status)
+        # So sánh trực tiếp created_at (không bọc DATE()) để dùng được index
         if start_date:
-            where_clauses.append("DATE(q.created_at) >= %s")
+            where_clauses.append("q.created_at >= %s")
             params.append(start_date)
         if end_date:
-            where_clauses.append("DATE(q.created_at) <= %s")
-            params.append(end_date)
+            where_clauses.append("q.created_at < %s")
+            params.append(end_date + timedelta(days=1))
         if search_term:
             search_pattern = f"%{search_term}%"
             search_clauses = []
@@ -75,56 +142,58 @@ async def get_questions_advanced(
         
         sql_where = " WHERE " + " AND ".join(where_clauses)
         
-        # Phần ORDER BY (Giữ nguyên)
-        order_clause = " ORDER BY "
-        if sort_by == "score_high":
-            order_clause += "e.total_score DESC, q.created_at DESC"
-        elif sort_by == "score_low":
-            order_clause += "e.total_score ASC, q.created_at DESC"
-        elif sort_by == "oldest":
-            order_clause += "q.created_at ASC"
-        else: # (newest)
-            order_clause += "q.created_at DESC"
-
-        # === 2. TRUY VẤN LẤY TỔNG SỐ LƯỢNG (COUNT) ===
-        # Chạy truy vấn đếm *trước khi* thêm LIMIT/OFFSET
-        
-        count_query = "SELECT COUNT(q.question_id) AS total_count" + sql_base + sql_where
-        cur.execute(count_query, tuple(params))
-        total_count = cur.fetchone()['total_count']
+        # Phần ORDER BY
+        order_clause = " ORDER BY " + ", ".join(
+            f"{_SORT_COLUMNS[name]} {direction}" for name, direction in _SORT_KEYS[sort_by]
+        )
 
-        # === 3. TRUY VẤN LẤY DỮ LIỆU PHÂN TRANG (LIMIT/OFFSET) ===
-        
-        # Tính toán OFFSET
-        offset = (page - 1) * page_size
-        
-        # Thêm LIMIT và OFFSET vào câu lệnh
-        sql_limit = " LIMIT %s OFFSET %s"
-        
-        # Thêm tham số LIMIT/OFFSET vào cuối
-        params.append(page_size)
-        params.append(offset)
+        # === 2. TỔNG SỐ LƯỢNG (COUNT) — tùy chọn, có cache ===
+        total_count = None
+        if include_total:
+            total_count = question_counts.get(user_id, filter_key)
+            if total_count is None:
+                count_query = "SELECT COUNT(q.question_id) AS total_count" + sql_base + sql_where
+                cur.execute(count_query, tuple(params))
+                total_count = cur.fetchone()['total_count']
+                question_counts.set(user_id, filter_key, total_count)
+
+        # === 3. TRUY VẤN LẤY DỮ LIỆU (KEYSET hoặc LIMIT/OFFSET) ===
+        # Lấy dư 1 dòng để biết còn trang sau hay không
+        if cursor:
+            keyset_sql, keyset_params = _keyset_clause(sort_by, _decode_cursor(cursor, sort_by, filter_key))
+            sql_where += " AND " + keyset_sql
+            params.extend(keyset_params)
+            sql_limit = " LIMIT %s"
+            params.append(page_size + 1)
+        else:
+            sql_limit = " LIMIT %s OFFSET %s"
+            params.append(page_size + 1)
+            params.append((page - 1) * page_size)
         
         # Xây dựng câu lệnh đầy đủ
         data_query = "SELECT q.*, e.total_score, e.status_by_agent" + sql_base + sql_where + order_clause + sql_limit
         
         cur.execute(data_query, tuple(params))
         data = cur.fetchall()
+        has_more = len(data) > page_size
+        data = data[:page_size]
         
         # === 4. TRẢ VỀ KẾT QUẢ CHO FRONTEND ===
         return {
-            "total_count": total_count, # Tổng số câu hỏi (để tính số trang)
+            "total_count": total_count, # Tổng số câu hỏi (để tính số trang); None nếu include_total=false
             "page_size": page_size,
-            "current_page": page,
-            "questions": data # Danh sách câu hỏi của trang này
+            "current_page": None if cursor else page,
+            "questions": data, # Danh sách câu hỏi của trang này
+            "next_cursor": _encode_cursor(sort_by, filter_key, data[-1]) if has_more else None,
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
         cur.close()
-        conn.close()
 
 
 # =========================================================================
@@ -134,7 +203,10 @@ async def get_questions_advanced(
 @router.get("/{question_id}")
 async def get_question_detail(question_id: int = Path(...), user=Depends(get_current_user)):
     """Get a single question (with evaluation)."""
-    conn = get_connection(); cur = conn.cursor(dictionary=True)
+    return await run_db(_get_question_detail, question_id, user)
+
+def _get_question_detail(conn, question_id, user):
+    cur = conn.cursor(dictionary=True)
     try:
         cur.execute("""
             SELECT q.*, e.model_version, e.total_score, e.accuracy_score, e.alignment_score,
@@ -148,7 +220,7 @@ async def get_question_detail(question_id: int = Path(...), user=Depends(get_cur
             raise HTTPException(status_code=404, detail="Question not found.")
         return row
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.put("/{question_id}")
 async def update_question(
@@ -160,7 +232,10 @@ async def update_question(
     user=Depends(get_current_user)
 ):
     """Update question content."""
-    conn = get_connection(); cur = conn.cursor()
+    return await run_db(_update_question, question_id, question_text, options_json, answer_letter, status, user)
+
+def _update_question(conn, question_id, question_text, options_json, answer_letter, status, user):
+    cur = conn.cursor()
     try:
         cur.execute("""
             UPDATE Questions
@@ -168,6 +243,7 @@ async def update_question(
             WHERE question_id = %s AND creator_id = %s
         """, (question_text, options_json, answer_letter, status, question_id, user["user_id"]))
         conn.commit()
+        question_counts.invalidate(user["user_id"])  # search_term có thể khớp khác đi
         if cur.rowcount == 0:
             cur.execute("SELECT question_id FROM Questions WHERE question_id=%s AND creator_id=%s",
                         (question_id, user["user_id"]))
@@ -175,12 +251,15 @@ async def update_question(
                 raise HTTPException(status_code=404, detail="Question not found.")
         return {"message": "✅ Question updated successfully."}
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.delete("/{question_id}")
 async def delete_question(question_id: int, user=Depends(get_current_user)):
     """Delete question and its evaluations."""
-    conn = get_connection(); cur = conn.cursor()
+    return await run_db(_delete_question, question_id, user)
+
+def _delete_question(conn, question_id, user):
+    cur = conn.cursor()
     try:
         cur.execute("DELETE FROM QuestionEvaluations WHERE question_id=%s", (question_id,))
         cur.execute("""
@@ -189,6 +268,7 @@ async def delete_question(question_id: int, user=Depends(get_current_user)):
         """, (question_id, user["user_id"]))
         affected_rows = cur.rowcount
         conn.commit()
+        question_counts.invalidate(user["user_id"])
 
         if affected_rows == 0:
             cur.execute("SELECT question_id FROM Questions WHERE question_id=%s AND creator_id=%s",
@@ -201,4 +281,4 @@ async def delete_question(question_id: int, user=Depends(get_current_user)):
         print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
-        cur.close(); conn.close()
\ No newline at end of file
+        cur.close()
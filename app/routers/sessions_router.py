@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, Form
 from typing import Optional
-from ..db import get_connection
+from ..db import run_db
 
 # === IMPORT XÁC THỰC ===
 from .auth_router import get_optional_current_user 
@@ -32,7 +32,9 @@ async def start_exam_session(
             detail="Bạn phải đăng nhập hoặc cung cấp tên (guest_name) để làm bài."
         )
 
-    conn = get_connection()
+    return await run_db(_start_exam_session, exam_id, current_user_id, current_guest_name)
+
+def _start_exam_session(conn, exam_id, current_user_id, current_guest_name):
     cur = conn.cursor()
     try:
         cur.execute(
@@ -57,7 +59,6 @@ async def start_exam_session(
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
         cur.close()
-        conn.close()
 
 
 # === ENDPOINT 2: LƯU ĐÁP ÁN (Sửa ? -> %s) ===
@@ -66,7 +67,9 @@ async def save_session_answers(
     session_id: int,
     payload: SaveAnswersPayload
 ):
-    conn = get_connection()
+    return await run_db(_save_session_answers, session_id, payload)
+
+def _save_session_answers(conn, session_id, payload):
     cur = conn.cursor(dictionary=True) 
     
     try:
@@ -118,7 +121,6 @@ async def save_session_answers(
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
         cur.close()
-        conn.close()
 
 
 # === ENDPOINT 3: NỘP BÀI (Sửa ? -> %s) ===
@@ -126,7 +128,9 @@ async def save_session_answers(
 async def submit_exam_and_score(
     session_id: int,
 ):
-    conn = get_connection()
+    return await run_db(_submit_exam_and_score, session_id)
+
+def _submit_exam_and_score(conn, session_id):
     cur = conn.cursor(dictionary=True)
     
     try:
@@ -158,13 +162,15 @@ async def submit_exam_and_score(
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
         cur.close()
-        conn.close()
 
 # === ENDPOINT 4: XEM KẾT QUẢ (File gốc của bạn đã đúng) ===
 @router.get("/{session_id}/results")
 async def get_exam_results(session_id: int):
     """Get session results."""
-    conn = get_connection(); cur = conn.cursor(dictionary=True)
+    return await run_db(_get_exam_results, session_id)
+
+def _get_exam_results(conn, session_id):
+    cur = conn.cursor(dictionary=True)
     try:
         cur.execute("""
             SELECT q.question_text, q.options, q.answer_letter,
@@ -175,7 +181,7 @@ async def get_exam_results(session_id: int):
         """, (session_id,))
         return cur.fetchall()
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 
 # === ENDPOINT 5: TẢI CÂU HỎI (Sửa ? -> %s) ===
@@ -184,7 +190,10 @@ async def get_session_questions(session_id: int):
     """
     Lấy toàn bộ câu hỏi cho một phiên làm bài.
     """
-    conn = get_connection(); cur = conn.cursor(dictionary=True)
+    return await run_db(_get_session_questions, session_id)
+
+def _get_session_questions(conn, session_id):
+    cur = conn.cursor(dictionary=True)
     try:
         # 1. Lấy exam_id từ session_id
         cur.execute("SELECT exam_id FROM ExamSessions WHERE session_id = %s", (session_id,)) # <-- ĐÃ SỬA
@@ -199,7 +208,7 @@ async def get_session_questions(session_id: int):
             SELECT q.question_id, q.question_text, q.options
             FROM ExamQuestions eq
             JOIN Questions q ON eq.question_id = q.question_id
-            WHERE eq.exam_id = %s
+            WHERE eq.exam_id = %s AND COALESCE(q.status, '') <> 'superseded'
             ORDER BY eq.order_index ASC 
         """, (exam_id,)) # <-- ĐÃ SỬA
         
@@ -210,4 +219,4 @@ async def get_session_questions(session_id: int):
         print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
-        cur.close(); conn.close()
\ No newline at end of file
+        cur.close()
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, Form
 from passlib.hash import bcrypt
-from ..db import get_connection
+from ..db import run_db
 from .auth_router import get_current_user, verify_password
 from datetime import date
 
@@ -18,7 +18,10 @@ async def get_current_user_profile(user: dict = Depends(get_current_user)):
 @router.get("/{user_id}")
 async def get_user_detail(user_id: int, user=Depends(get_current_user)):
     """Get user info (self or admin only)."""
-    conn = get_connection(); cur = conn.cursor(dictionary=True)
+    return await run_db(_get_user_detail, user_id, user)
+
+def _get_user_detail(conn, user_id, user):
+    cur = conn.cursor(dictionary=True)
     try:
         if user["user_id"] != user_id and user.get("is_admin", 0) == 0:
             raise HTTPException(status_code=403, detail="Permission denied.")
@@ -32,7 +35,7 @@ async def get_user_detail(user_id: int, user=Depends(get_current_user)):
             raise HTTPException(status_code=404, detail="User not found.")
         return row
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.put("/{user_id}")
 async def update_user(
@@ -63,18 +66,27 @@ async def update_user(
     if user["user_id"] != user_id and is_admin == 0:
         raise HTTPException(status_code=403, detail="Permission denied.")
 
+    if password and not old_password:
+        raise HTTPException(status_code=400, detail="Vui lòng nhập mật khẩu cũ để đổi mật khẩu.")
+
+    # Truy vấn DB và bcrypt (tốn CPU) chạy trên executor DB, không chặn event loop
+    return await run_db(
+        _update_user, user_id, is_admin, username, email, full_name, phone_number, birth,
+        old_password, password, is_active,
+    )
+
+def _update_user(conn, user_id, is_admin, username, email, full_name, phone_number, birth,
+                 old_password, password, is_active):
     fields, params = [], []
 
     # === 2. XỬ LÝ ĐỔI MẬT KHẨU (Giữ nguyên logic) ===
     if password: 
-        if not old_password:
-            raise HTTPException(status_code=400, detail="Vui lòng nhập mật khẩu cũ để đổi mật khẩu.")
-        
-        conn_pass = get_connection()
-        cur_pass = conn_pass.cursor(dictionary=True)
-        cur_pass.execute("SELECT password_hash FROM Users WHERE user_id=%s", (user_id,))
-        user_db = cur_pass.fetchone()
-        cur_pass.close(); conn_pass.close()
+        cur_pass = conn.cursor(dictionary=True)
+        try:
+            cur_pass.execute("SELECT password_hash FROM Users WHERE user_id=%s", (user_id,))
+            user_db = cur_pass.fetchone()
+        finally:
+            cur_pass.close()
 
         if not user_db:
             raise HTTPException(status_code=404, detail="User not found.")
@@ -119,7 +131,7 @@ async def update_user(
 
     params.append(user_id) 
 
-    conn = get_connection(); cur = conn.cursor()
+    cur = conn.cursor()
     try:
         sql = f"UPDATE Users SET {', '.join(fields)} WHERE user_id=%s"
         cur.execute(sql, tuple(params))
@@ -135,12 +147,15 @@ async def update_user(
         print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}")
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.put("/{user_id}/deactivate")
 async def deactivate_user(user_id: int, user=Depends(get_current_user)):
     """Soft deactivate user."""
-    conn = get_connection(); cur = conn.cursor()
+    return await run_db(_deactivate_user, user_id, user)
+
+def _deactivate_user(conn, user_id, user):
+    cur = conn.cursor()
     try:
         if user["user_id"] != user_id and user.get("is_admin", 0) == 0:
             raise HTTPException(status_code=403, detail="Permission denied.")
@@ -157,12 +172,15 @@ async def deactivate_user(user_id: int, user=Depends(get_current_user)):
         print(f"LỖI NGHIÊM TRỌNG TẠI [tên_router]: {e}") 
         raise HTTPException(status_code=500, detail="Đã xảy ra lỗi máy chủ nội bộ.")
     finally:
-        cur.close(); conn.close()
+        cur.close()
 
 @router.put("/{user_id}/activate")
 async def activate_user(user_id: int, user=Depends(get_current_user)):
     """Reactivate user (admin only)."""
-    conn = get_connection(); cur = conn.cursor()
+    return await run_db(_activate_user, user_id, user)
+
+def _activate_user(conn, user_id, user):
+    cur = conn.cursor()
     try:
         if user.get("is_admin", 0) == 0:
             raise HTTPException(status_code=403, detail="Admin only.")
@@ -170,4 +188,4 @@ async def activate_user(user_id: int, user=Depends(get_current_user)):
         conn.commit()
         return {"message": "✅ User reactivated successfully."}
     finally:
-        cur.close(); conn.close()
\ No newline at end of file
+        cur.close()
@@ -1,90 +1,317 @@
+import asyncio
 import hashlib
+import io
 import json
+import multiprocessing
 import os
 import tempfile
-from typing import Tuple
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Optional, Tuple
 import fitz
 from docx import Document
-from google import genai
-import google.generativeai as genai_old
-from .config import GOOGLE_API_KEY, MAX_FILE_SIZE_MB
-from .utils import clean_text, check_file_size_bytes, safe_filename
-
-EVAL_CACHE = {}
-
-if GOOGLE_API_KEY:
-    genai_old.configure(api_key=GOOGLE_API_KEY)
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+from .cache import LRUCache, llm_cache, make_cache_key, hash_file
+from .config import (
+    BATCH_MAX_ARCHIVE_MB,
+    BATCH_MAX_FILES,
+    EVAL_BATCH_SIZE,
+    EVAL_CACHE_MAX_MB,
+    EVAL_MAX_PARALLEL_BATCHES,
+    LLM_PARSE_RETRIES,
+    MAX_FILE_SIZE_MB,
+    MAX_PROMPT_TOKENS,
+    PDF_EXTRACT_WORKERS,
+    PDF_PARALLEL_PAGE_THRESHOLD,
+)
+from .llm import DEFAULT_MODEL, delete_file, generate_text, upload_file
+from .metrics import EXTRACTION_BYTES, EXTRACTION_DURATION, LLM_RETRIES, POOL_BUSY, POOL_SIZE
+from .utils import (
+    clean_text,
+    estimate_tokens,
+    normalize_question_key,
+    parse_json_lenient,
+    safe_filename,
+    salvage_json_objects,
+    split_text_by_tokens,
+    stream_upload,
+)
+
+# Cache đánh giá theo từng câu hỏi (LRU giới hạn theo byte)
+EVAL_CACHE = LRUCache(EVAL_CACHE_MAX_MB * 1024 * 1024, stage="evaluate")
+
+# Phiên bản prompt: tăng khi sửa prompt để cache trên đĩa không trả kết quả của prompt cũ
+SUMMARY_PROMPT_VERSION = "summary-v1"
+GENERATE_PROMPT_VERSION = "generate-v1"
+EVALUATE_PROMPT_VERSION = "evaluate-v1"
+AUDIO_SUMMARY_PROMPT_VERSION = "audio-summary-v1"
+AUDIO_TRANSCRIPT_PROMPT_VERSION = "audio-transcript-v1"
+
+SUPPORTED_DOCUMENT_SUFFIXES = (".pdf", ".doc", ".docx", ".txt")
+
+# Câu hỏi "giả" trả về khi Gemini không sinh được JSON hợp lệ
+GENERATION_FAILED_QUESTION = "Không thể tạo câu hỏi hợp lệ từ nội dung này."
+
+_pdf_executor = None
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    global _pdf_executor
+    if _pdf_executor is None:
+        # "spawn": fork từ server đa luồng (event loop, pool DB, gRPC) có thể làm process con deadlock
+        _pdf_executor = ProcessPoolExecutor(
+            max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+        POOL_SIZE.set(PDF_EXTRACT_WORKERS, pool="pdf_extract")
+    return _pdf_executor
 
+def _open_pdf(source):
+    """`source`: bytes của PDF (mở trực tiếp, không ghi file tạm) hoặc đường dẫn file."""
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source, filetype="pdf")
 
-client = genai.Client(api_key=GOOGLE_API_KEY)
+def _extract_pdf_page_range(content, start: int, stop: int) -> str:
+    """Chạy trong process con: trích text các trang [start, stop)."""
+    with _open_pdf(content) as pdf:
+        return "".join([pdf[i].get_text() for i in range(start, stop)])
 
-def extract_text_from_pdf_bytes(content: bytes) -> str:
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-        tmp.write(content)
-        tmp_path = tmp.name
-    text = ""
-    try:
-        with fitz.open(tmp_path) as pdf:
-            for page in pdf:
-                text += page.get_text()
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
-    return text
-
-def extract_text_from_docx_bytes(content: bytes) -> str:
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as tmp:
-        tmp.write(content)
-        tmp_path = tmp.name
-    text = ""
-    try:
-        doc = Document(tmp_path)
-        text = '\n'.join([p.text for p in doc.paragraphs])
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
-    return text
-
-def extract_text_from_txt_bytes(content: bytes) -> str:
+def extract_text_from_pdf_bytes(content) -> str:
+    """
+    Mở PDF từ bytes hoặc đường dẫn file (tài liệu batch đã spool ra đĩa: process con tự
+    mở file, không phải gửi cả PDF qua pipe) và nối text các trang một lần.
+    PDF từ PDF_PARALLEL_PAGE_THRESHOLD trang trở lên được chia theo dải trang
+    và trích song song trên process pool.
+    """
+    with _open_pdf(content) as pdf:
+        page_count = pdf.page_count
+        if page_count < PDF_PARALLEL_PAGE_THRESHOLD or PDF_EXTRACT_WORKERS <= 1:
+            return "".join([page.get_text() for page in pdf])
+
+    executor = _get_pdf_executor()
+    step = -(-page_count // PDF_EXTRACT_WORKERS)
+    futures = []
+    for start in range(0, page_count, step):
+        POOL_BUSY.inc(pool="pdf_extract")
+        future = executor.submit(_extract_pdf_page_range, content, start, min(start + step, page_count))
+        future.add_done_callback(lambda _: POOL_BUSY.dec(pool="pdf_extract"))
+        futures.append(future)
+    return "".join([f.result() for f in futures])
+
+_W_P = qn("w:p")
+_W_TBL = qn("w:tbl")
+_W_TR = qn("w:tr")
+_W_TC = qn("w:tc")
+_W_SDT_CONTENT = qn("w:sdtContent")
+
+def _iter_docx_blocks(element, parent):
+    """Duyệt paragraph và ô bảng theo đúng thứ tự trong tài liệu (kể cả bảng lồng nhau).
+
+    Đi thẳng trên XML của body: ô gộp ngang (gridSpan) là một w:tc duy nhất nên không bị lặp.
+    """
+    for child in element.iterchildren():
+        tag = child.tag
+        if tag == _W_P:
+            yield Paragraph(child, parent).text
+        elif tag == _W_TBL:
+            for tr in child.iterchildren(_W_TR):
+                for tc in tr.iterchildren(_W_TC):
+                    yield from _iter_docx_blocks(tc, parent)
+        else:
+            # Content control (w:sdt) có thể bọc paragraph/bảng bên trong
+            content = child.find(_W_SDT_CONTENT)
+            if content is not None:
+                yield from _iter_docx_blocks(content, parent)
+
+def extract_text_from_docx_bytes(content) -> str:
+    """Đọc DOCX trực tiếp từ bytes (không ghi đĩa) hoặc từ đường dẫn file, gồm cả text trong bảng."""
+    doc = Document(io.BytesIO(content) if isinstance(content, (bytes, bytearray)) else content)
+    return '\n'.join(_iter_docx_blocks(doc.element.body, doc))
+
+def extract_text_from_txt_bytes(content) -> str:
+    if not isinstance(content, (bytes, bytearray)):
+        with open(content, "rb") as f:
+            content = f.read()
     return content.decode('utf-8', errors='ignore')
 
 async def extract_and_clean_from_uploadfile(upload_file) -> Tuple[bool, str]:
-    raw = await upload_file.read()
-    ok, msg = check_file_size_bytes(raw, MAX_FILE_SIZE_MB)
+    # Đọc theo từng khối, dừng ngay khi vượt MAX_FILE_SIZE_MB
+    buffer = io.BytesIO()
+    ok, msg = await stream_upload(upload_file, buffer, MAX_FILE_SIZE_MB)
     if not ok:
         return False, msg
+    raw = buffer.getvalue()
+    buffer.close()
+    return await extract_and_clean_from_bytes(upload_file.filename, raw)
+
+async def extract_and_clean_from_bytes(filename: str, raw: bytes) -> Tuple[bool, str]:
+    return await _extract_document(filename, raw, len(raw))
+
+async def extract_and_clean_from_path(filename: str, path: str) -> Tuple[bool, str]:
+    """Như extract_and_clean_from_bytes nhưng đọc tài liệu đã spool ra đĩa (batch)."""
+    return await _extract_document(filename, path, os.path.getsize(path))
+
+async def _extract_document(filename: str, source, size: int) -> Tuple[bool, str]:
+    suffix = os.path.splitext(safe_filename(filename))[1].lower()
+    if suffix not in SUPPORTED_DOCUMENT_SUFFIXES:
+        return False, 'Định dạng không hỗ trợ. Hỗ trợ: PDF, DOCX, TXT.'
+
+    file_type = suffix.lstrip(".")
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        ok, text = await _extract_and_clean(suffix, source)
+        outcome = "success" if ok else "empty"
+        return ok, text
+    finally:
+        EXTRACTION_DURATION.observe(time.perf_counter() - start, file_type=file_type, outcome=outcome)
+        EXTRACTION_BYTES.inc(size, file_type=file_type)
 
-    suffix = os.path.splitext(safe_filename(upload_file.filename))[1].lower()
+async def _extract_and_clean(suffix: str, source) -> Tuple[bool, str]:
+    # Trích xuất là việc CPU/blocking → chạy ngoài event loop
     if suffix == '.pdf':
-        text = extract_text_from_pdf_bytes(raw)
+        text = await asyncio.to_thread(extract_text_from_pdf_bytes, source)
     elif suffix in ('.doc', '.docx'):
-        text = extract_text_from_docx_bytes(raw)
-    elif suffix == '.txt':
-        text = extract_text_from_txt_bytes(raw)
+        text = await asyncio.to_thread(extract_text_from_docx_bytes, source)
+    elif isinstance(source, (bytes, bytearray)):
+        text = extract_text_from_txt_bytes(source)
     else:
-        return False, 'Định dạng không hỗ trợ. Hỗ trợ: PDF, DOCX, TXT.'
+        text = await asyncio.to_thread(extract_text_from_txt_bytes, source)
 
     cleaned = clean_text(text)
     if not cleaned:
         return False, 'Không thể trích xuất nội dung từ file (file rỗng hoặc lỗi).'
     return True, cleaned
 
-def call_gemini_summarize(text: str, model_name: str = "gemini-2.5-flash") -> str:
-    model = genai_old.GenerativeModel(model_name, tools=[])
+def _spool_path(workdir: str, index: int, filename: str) -> str:
+    # Tên file tạm theo thứ tự (tên gốc có thể trùng nhau giữa các ZIP), giữ phần mở rộng
+    return os.path.join(workdir, f"{index:04d}{os.path.splitext(filename)[1].lower()}")
+
+def _read_zip_documents(archive, max_bytes: int, workdir: str, first_index: int) -> list:
+    """
+    Spool các tài liệu trong một file ZIP ra `workdir` → list {"filename", "path"} hoặc
+    {"filename", "error"}. Bỏ qua thư mục / file ẩn; mỗi file được copy theo từng khối và
+    dừng ngay khi vượt max_bytes (chặn zip bomb), không giữ nội dung trong RAM.
+    """
+    entries = []
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            name = safe_filename(info.filename)
+            if info.is_dir() or not name or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+            if os.path.splitext(name)[1].lower() not in SUPPORTED_DOCUMENT_SUFFIXES:
+                entries.append({"filename": name, "error": "Định dạng không hỗ trợ. Hỗ trợ: PDF, DOCX, TXT."})
+                continue
+            if info.flag_bits & 0x1:
+                entries.append({"filename": name, "error": "File trong ZIP bị mã hóa."})
+                continue
+            if info.file_size > max_bytes:
+                entries.append({"filename": name, "error": f"File quá lớn (> {MAX_FILE_SIZE_MB}MB)."})
+                continue
+            path = _spool_path(workdir, first_index + len(entries), name)
+            total = 0
+            with zf.open(info) as src, open(path, "wb") as dest:
+                while total <= max_bytes:
+                    chunk = src.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    dest.write(chunk)
+            if total > max_bytes:
+                os.remove(path)
+                entries.append({"filename": name, "error": f"File quá lớn (> {MAX_FILE_SIZE_MB}MB)."})
+                continue
+            entries.append({"filename": name, "path": path})
+    return entries
+
+async def read_batch_uploads(upload_files: list, workdir: str):
+    """
+    Đọc nhiều UploadFile (tài liệu và/hoặc ZIP chứa tài liệu) cho /agent/batch.
+    Mỗi tài liệu được spool ra một file trong `workdir` (caller xóa thư mục khi xong),
+    nên bộ nhớ không tăng theo BATCH_MAX_FILES × MAX_FILE_SIZE_MB.
+    Trả về (True, entries) với entries = list {"filename", "path"} hoặc {"filename", "error"},
+    hoặc (False, thông báo lỗi) nếu cả request không hợp lệ.
+    """
+    max_bytes = MAX_FILE_SIZE_MB * 1024 * 1024
+    entries = []
+    for upload_file in upload_files:
+        filename = safe_filename(upload_file.filename or "")
+        if filename.lower().endswith(".zip"):
+            # ZIP có thể lớn → ghi ra đĩa khi vượt 8MB thay vì giữ trong RAM
+            with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as archive:
+                ok, msg = await stream_upload(upload_file, archive, BATCH_MAX_ARCHIVE_MB)
+                if not ok:
+                    return False, f"{filename}: {msg}"
+                archive.seek(0)
+                try:
+                    entries.extend(await asyncio.to_thread(
+                        _read_zip_documents, archive, max_bytes, workdir, len(entries)
+                    ))
+                except zipfile.BadZipFile:
+                    entries.append({"filename": filename, "error": "File ZIP không hợp lệ."})
+        else:
+            path = _spool_path(workdir, len(entries), filename)
+            with open(path, "wb") as dest:
+                ok, msg = await stream_upload(upload_file, dest, MAX_FILE_SIZE_MB)
+            if ok:
+                entries.append({"filename": filename, "path": path})
+            else:
+                os.remove(path)
+                entries.append({"filename": filename, "error": msg})
+        if len(entries) > BATCH_MAX_FILES:
+            return False, f"Tối đa {BATCH_MAX_FILES} tài liệu mỗi lần."
+    if not entries:
+        return False, "Không có tài liệu nào trong request."
+    return True, entries
+
+async def call_gemini_summarize(text: str, model_name: str = DEFAULT_MODEL) -> str:
+    cache_key = make_cache_key("summarize", model_name, SUMMARY_PROMPT_VERSION, text)
+    cached = await llm_cache.aget(cache_key)
+    if cached is not None:
+        return cached
+
     # Yêu cầu model tự phát hiện ngôn ngữ đầu vào và trả về bản tóm tắt bằng cùng ngôn ngữ
     prompt = (
         "Hãy phát hiện ngôn ngữ của văn bản dưới đây. Sau đó tạo một bản tóm tắt ngắn gọn, rõ ràng và đầy đủ bằng cùng một ngôn ngữ.\n"
         f"Nội dung:\n{text}"
     )
-    resp = model.generate_content([prompt])
-    return resp.text.strip()
+    summary = await generate_text([prompt], model_name, task="summarize")
+    if summary:
+        await llm_cache.aset(cache_key, summary)
+    return summary
+
+async def call_gemini_summarize_hierarchical(text: str, model_name: str = DEFAULT_MODEL,
+                                             max_tokens: int = MAX_PROMPT_TOKENS) -> str:
+    """
+    Tóm tắt văn bản có độ dài bất kỳ mà không prompt nào vượt max_tokens (ước lượng):
+    văn bản vừa ngân sách → tóm tắt một lần; ngược lại chia chunk, tóm tắt các chunk
+    song song rồi tóm tắt tiếp phần ghép các bản tóm tắt (đệ quy) cho tới khi vừa.
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return await call_gemini_summarize(text, model_name)
+
+    chunks = split_text_by_tokens(text, max_tokens)
+    print(f"📚 Tóm tắt phân cấp: ~{tokens} token → {len(chunks)} phần.")
+    summaries = await asyncio.gather(*(call_gemini_summarize(chunk, model_name) for chunk in chunks))
+    combined = "\n\n".join(summary for summary in summaries if summary)
+    if not combined:
+        return ""
+
+    if estimate_tokens(combined) >= tokens:
+        # Bản tóm tắt không ngắn hơn đầu vào (hiếm): cắt bớt để chắc chắn dừng đệ quy
+        print("⚠️  Tóm tắt phân cấp không rút gọn được văn bản, cắt theo ngân sách token.")
+        combined = split_text_by_tokens(combined, max_tokens)[0]
+    return await call_gemini_summarize_hierarchical(combined, model_name, max_tokens)
+
+def contains_failed_generation(mcqs) -> bool:
+    """True nếu kết quả có câu hỏi lỗi (fallback) — khác với kết quả rỗng hợp lệ."""
+    return isinstance(mcqs, list) and any(
+        isinstance(q, dict) and q.get("question") == GENERATION_FAILED_QUESTION for q in mcqs
+    )
 
-def call_gemini_generate_mcqs(text: str, num_questions: int = 5, model_name: str = "gemini-2.5-flash") -> list:
-    model = genai_old.GenerativeModel(model_name, tools=[])
+def _generate_prompt(text: str, num_questions: int, avoid: Optional[list] = None) -> str:
     # Yêu cầu model phát hiện ngôn ngữ đầu vào và sinh câu hỏi trắc nghiệm bằng cùng ngôn ngữ
     prompt = f"""
     Bạn là hệ thống AI chuyên sinh câu hỏi trắc nghiệm.
@@ -133,54 +360,117 @@ def call_gemini_generate_mcqs(text: str, num_questions: int = 5, model_name: str
     - Nếu không thể tạo hợp lệ, trả về `[]`.  
     - Giữ nguyên văn context, không được tóm tắt hay cắt ngắn.
     """
+    if avoid:
+        # Lần gọi lại chỉ để bù câu còn thiếu: không sinh lại các câu đã có
+        prompt += "\n    **Các câu hỏi đã có (KHÔNG lặp lại):**\n" + "\n".join(f"    - {q}" for q in avoid) + "\n"
+    return prompt
 
-    resp = model.generate_content([prompt])
-    mcq_text = resp.text.strip()
+def _is_question_item(item) -> bool:
+    return isinstance(item, dict) and bool(item.get("question")) and isinstance(item.get("options"), list)
 
-    if mcq_text.startswith("```json"):
-        mcq_text = mcq_text[7:]
-    if mcq_text.startswith("```"):
-        mcq_text = mcq_text[3:]
-    if mcq_text.endswith("```"):
-        mcq_text = mcq_text[:-3]
-    mcq_text = mcq_text.strip()
-
-    try:
-        data = json.loads(mcq_text)
-    except Exception:
-        data = [{
-            "context": text[:200] + "...",
-            "question": "Không thể tạo câu hỏi hợp lệ từ nội dung này.",
-            "options": ["Lỗi", "Lỗi", "Lỗi", "Lỗi"],
-            "answer": "A. Lỗi"
-        }]
-    return data
-
-# tools.py
-def extract_text_from_audio_with_gemini(file_path: str, model_name: str = "gemini-2.5-flash") -> str:
+def _parse_questions(mcq_text: str) -> Tuple[list, bool]:
     """
-    Dùng Gemini 2.5 (SDK mới) để tóm tắt audio mà không lỗi ragStoreName.
+    (câu hỏi đọc được, complete). complete=False khi JSON hỏng / bị cắt cụt / có phần tử sai
+    dạng: khi đó vẫn cứu mọi câu hỏi còn nguyên vẹn thay vì bỏ cả output.
     """
-    prompt = (
-        "Hãy nghe kỹ nội dung trong đoạn ghi âm này, "
-        "phát hiện ngôn ngữ được nói và tóm tắt lại ngắn gọn, rõ ràng, đầy đủ bằng chính ngôn ngữ đó."
-    )
+    data = parse_json_lenient(mcq_text)
+    if isinstance(data, list):
+        items = [q for q in data if _is_question_item(q)]
+        return items, len(items) == len(data)
+    return salvage_json_objects(mcq_text, _is_question_item), False
+
+async def call_gemini_generate_mcqs(text: str, num_questions: int = 5, model_name: str = DEFAULT_MODEL) -> list:
+    cache_key = make_cache_key("generate", model_name, GENERATE_PROMPT_VERSION, text, num_questions)
+    cached = await llm_cache.aget(cache_key)
+    if cached is not None:
+        return cached
+
+    mcq_text = await generate_text([_generate_prompt(text, num_questions)], model_name, task="generate")
+    data, complete = _parse_questions(mcq_text)
+
+    # Output hỏng: chỉ gọi lại để sinh phần còn thiếu (model trả ít hơn vì hết nội dung thì không gọi lại)
+    retries = 0
+    while not complete and len(data) < num_questions and retries < LLM_PARSE_RETRIES:
+        retries += 1
+        missing = num_questions - len(data)
+        print(f"⚠️  JSON câu hỏi không hợp lệ, giữ {len(data)} câu, sinh lại {missing} câu còn thiếu...")
+        LLM_RETRIES.inc(task="generate")
+        try:
+            more_text = await generate_text(
+                [_generate_prompt(text, missing, avoid=[q["question"] for q in data])], model_name, task="generate"
+            )
+        except Exception as e:
+            print(f"❌ Lỗi khi sinh lại câu hỏi: {e}")
+            break
+        more, complete = _parse_questions(more_text)
+        data.extend(more[:missing])
+
+    if complete or len(data) >= num_questions:
+        await llm_cache.aset(cache_key, data)
+        return data
+    if data:
+        # Kết quả thiếu do output hỏng: vẫn dùng nhưng không cache, lần sau gọi lại Gemini
+        return data
+    return [{
+        "context": text[:200] + "...",
+        "question": GENERATION_FAILED_QUESTION,
+        "options": ["Lỗi", "Lỗi", "Lỗi", "Lỗi"],
+        "answer": "A. Lỗi"
+    }]
+
+class SharedAudioUpload:
+    """
+    Upload file audio lên Gemini tối đa MỘT lần, dùng chung handle cho nhiều prompt.
+    Upload chỉ xảy ra khi có prompt thật sự cần gọi Gemini (cache miss);
+    close() xóa file đã upload trên server Gemini.
+    """
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._task = None
+
+    async def get(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(upload_file(self.file_path))
+        # shield: một prompt bị hủy không được hủy luôn upload của prompt còn lại
+        return await asyncio.shield(self._task)
+
+    async def close(self):
+        if self._task is None:
+            return
+        try:
+            uploaded_file = await self._task
+            await delete_file(uploaded_file)
+        except Exception as e:
+            print(f"⚠️  Không xóa được file audio trên Gemini: {e}")
+
+async def _run_audio_prompt(stage: str, prompt_version: str, prompt: str, file_path: str,
+                            model_name: str, audio_hash: str = None, upload: SharedAudioUpload = None) -> str:
+    if audio_hash is None:
+        audio_hash = await asyncio.to_thread(hash_file, file_path)
+    cache_key = make_cache_key(stage, model_name, prompt_version, audio_hash)
+    cached = await llm_cache.aget(cache_key)
+    if cached is not None:
+        return cached
+
+    own_upload = upload is None
+    if own_upload:
+        upload = SharedAudioUpload(file_path)
     try:
-        uploaded_file = client.files.upload(file=file_path)
-        response = client.models.generate_content(
-            model=model_name,
-            contents=[prompt, uploaded_file]
-        )
-        return response.text.strip()
-    except Exception as e:
-        return f"[Lỗi Gemini audio summarize] {str(e)}"
+        uploaded_file = await upload.get()
+        text = await generate_text([prompt, uploaded_file], model_name, task=stage)
+    finally:
+        if own_upload:
+            await upload.close()
+    if text:
+        await llm_cache.aset(cache_key, text)
+    return text
 
+AUDIO_SUMMARY_PROMPT = (
+    "Hãy nghe kỹ nội dung trong đoạn ghi âm này, "
+    "phát hiện ngôn ngữ được nói và tóm tắt lại ngắn gọn, rõ ràng, đầy đủ bằng chính ngôn ngữ đó."
+)
 
-def extract_transcript_from_audio_with_gemini(file_path: str, model_name: str = "gemini-2.5-flash") -> str:
-    """
-    Dùng Gemini 2.5 (SDK mới) để chép lại transcript audio mà không lỗi ragStoreName.
-    """
-    prompt =f"""
+AUDIO_TRANSCRIPT_PROMPT = """
         Bạn là một trợ lý AI chuyên nghiệp về gỡ băng hội thoại. Nhiệm vụ của bạn là tạo ra một bản transcript chính xác.
 
         Hãy thực hiện các bước sau:
@@ -198,17 +488,53 @@ def extract_transcript_from_audio_with_gemini(file_path: str, model_name: str =
             * Chỉ cung cấp bản gỡ băng (transcript).
             * Không tóm tắt.
             * Không bỏ sót chi tiết của **người nói chính**.
+"""
+
+async def extract_text_from_audio_with_gemini(file_path: str, model_name: str = DEFAULT_MODEL,
+                                              audio_hash: str = None, upload: SharedAudioUpload = None) -> str:
+    """
+    Dùng Gemini 2.5 (SDK mới) để tóm tắt audio mà không lỗi ragStoreName.
+    """
+    try:
+        return await _run_audio_prompt(
+            "audio_summary", AUDIO_SUMMARY_PROMPT_VERSION, AUDIO_SUMMARY_PROMPT,
+            file_path, model_name, audio_hash, upload,
+        )
+    except Exception as e:
+        return f"[Lỗi Gemini audio summarize] {str(e)}"
+
+
+async def extract_transcript_from_audio_with_gemini(file_path: str, model_name: str = DEFAULT_MODEL,
+                                                    audio_hash: str = None, upload: SharedAudioUpload = None) -> str:
+    """
+    Dùng Gemini 2.5 (SDK mới) để chép lại transcript audio mà không lỗi ragStoreName.
     """
     try:
-        uploaded_file = client.files.upload(file=file_path)
-        response = client.models.generate_content(
-            model=model_name,
-            contents=[prompt, uploaded_file]
+        return await _run_audio_prompt(
+            "audio_transcript", AUDIO_TRANSCRIPT_PROMPT_VERSION, AUDIO_TRANSCRIPT_PROMPT,
+            file_path, model_name, audio_hash, upload,
         )
-        return response.text.strip()
     except Exception as e:
         return f"[Lỗi Gemini transcript] {str(e)}"
 
+async def process_audio_with_gemini(file_path: str, with_summary: bool = True,
+                                    model_name: str = DEFAULT_MODEL) -> Tuple[str, Optional[str]]:
+    """
+    Upload audio MỘT lần rồi chạy song song prompt transcript và (tùy chọn) prompt tóm tắt
+    trên cùng file đã upload. File trên Gemini được xóa khi xong.
+    Trả về (transcript, summary); summary là None nếu with_summary=False.
+    """
+    audio_hash = await asyncio.to_thread(hash_file, file_path)
+    upload = SharedAudioUpload(file_path)
+    try:
+        tasks = [extract_transcript_from_audio_with_gemini(file_path, model_name, audio_hash, upload)]
+        if with_summary:
+            tasks.append(extract_text_from_audio_with_gemini(file_path, model_name, audio_hash, upload))
+        results = await asyncio.gather(*tasks)
+    finally:
+        await upload.close()
+    return results[0], (results[1] if with_summary else None)
+
 def get_hash_key(context, question):
     # Ép toàn bộ phần tử về string, tránh lỗi tuple/bool/int
     def to_str(x):
@@ -220,38 +546,97 @@ def get_hash_key(context, question):
     question_str = to_str(question)
     return hashlib.md5((context_str + question_str).encode("utf-8")).hexdigest()
 
-def evaluate_mcq(mcq, context_text: str = "") -> dict:
+def _question_fingerprint(q) -> str:
+    """Chỉ lấy phần nội dung của câu hỏi (bỏ các field phụ như score, _eval_breakdown...)."""
+    if not isinstance(q, dict):
+        return str(q)
+    content = {k: q.get(k) for k in ("context", "question", "options", "answer_letter", "answer")}
+    return json.dumps(content, ensure_ascii=False, sort_keys=True)
+
+def _apply_evaluation(q, evaluation: dict) -> dict:
+    result = dict(q)
+    for k, v in evaluation.items():
+        result[k] = dict(v) if isinstance(v, dict) else v
+    return result
+
+def _make_eval_fallback(q, error) -> dict:
+    fb = dict(q)
+    fb["score"] = 0
+    fb["status"] = "rejected"
+    fb["_eval_breakdown"] = {
+        "accuracy": 0,
+        "alignment": 0,
+        "distractors": 0,
+        "clarity": 0,
+    }
+    fb["comment"] = f"Lỗi khi gọi Gemini: {str(error)}"
+    return fb
+
+async def evaluate_mcq(
+    mcq,
+    context_text: str = "",
+    model_name: str = DEFAULT_MODEL,
+    on_result: Optional[Callable[[dict], Awaitable[None]]] = None,
+) -> dict:
     """
     Đánh giá một hoặc nhiều câu hỏi trắc nghiệm (MCQs) dựa trên context.
+
+    Cache theo TỪNG câu hỏi (context + nội dung câu hỏi): RAM (EVAL_CACHE, LRU) rồi tới đĩa.
+    Chỉ những câu chưa có trong cache mới được gửi cho Gemini, chia batch và chấm song song.
+    Nếu có `on_result`, mỗi câu đã chấm được gửi vào đó ngay khi batch của nó xong.
     """
-    if isinstance(mcq, list) and len(mcq) > 5:
-        results = []
-        batch_size = 5  # mỗi lần chấm tối đa 5 câu
-        for i in range(0, len(mcq), batch_size):
-            sub_batch = mcq[i:i + batch_size]
-            print(f"⚙️  Đánh giá batch {i//batch_size + 1} ({len(sub_batch)} câu)...")
-            sub_result = evaluate_mcq(sub_batch, context_text)  # gọi lại chính hàm này
-            # nếu trả về list → nối vào kết quả
-            if isinstance(sub_result, list):
-                results.extend(sub_result)
+    questions = mcq if isinstance(mcq, list) else [mcq]
+    results = [None] * len(questions)
+
+    # ✅ Cache check cho từng câu
+    keys = []
+    for i, q in enumerate(questions):
+        key = get_hash_key(context_text, _question_fingerprint(q))
+        keys.append(key)
+        evaluation = EVAL_CACHE.get(key)
+        if evaluation is None:
+            disk_key = make_cache_key("evaluate", model_name, EVALUATE_PROMPT_VERSION, key)
+            evaluation = await llm_cache.aget(disk_key)
+            if evaluation is not None:
+                EVAL_CACHE.set(key, evaluation)
+        if evaluation is not None:
+            results[i] = _apply_evaluation(q, evaluation)
+
+    if on_result is not None:
+        for r in results:
+            if r is not None:
+                await on_result(r)
+
+    missing = [i for i, r in enumerate(results) if r is None]
+    batch_size = EVAL_BATCH_SIZE  # mỗi lần chấm tối đa EVAL_BATCH_SIZE câu (mặc định 5)
+    batches = [missing[b:b + batch_size] for b in range(0, len(missing), batch_size)]
+
+    # Các batch chạy song song (tối đa EVAL_MAX_PARALLEL_BATCHES batch cùng lúc),
+    # batch nào lỗi thì chỉ batch đó bị fallback
+    limiter = asyncio.Semaphore(EVAL_MAX_PARALLEL_BATCHES)
+
+    async def run_batch(n, idx):
+        async with limiter:
+            if len(batches) > 1:
+                print(f"⚙️  Đánh giá batch {n + 1}/{len(batches)} ({len(idx)} câu)...")
+            evaluations = await _evaluate_batch([questions[i] for i in idx], context_text, model_name)
+
+        for i, evaluation in zip(idx, evaluations):
+            if isinstance(evaluation, Exception):
+                results[i] = _make_eval_fallback(questions[i], evaluation)
             else:
-                results.append(sub_result)
-        return results
-    
-    global EVAL_CACHE
-
-    # ✅ Gom danh sách câu hỏi
-    if isinstance(mcq, list):
-        question_data = mcq
-        key = get_hash_key(context_text, "MULTI_" + str(len(mcq)))
-    else:
-        question_data = [mcq]
-        key = get_hash_key(context_text, mcq.get("question", ""))
+                results[i] = _apply_evaluation(questions[i], evaluation)
+                EVAL_CACHE.set(keys[i], evaluation)
+                disk_key = make_cache_key("evaluate", model_name, EVALUATE_PROMPT_VERSION, keys[i])
+                await llm_cache.aset(disk_key, evaluation)
+            if on_result is not None:
+                await on_result(results[i])
+
+    await asyncio.gather(*(run_batch(n, idx) for n, idx in enumerate(batches)))
 
-    # ✅ Cache check (chỉ cache nếu 1 lần duy nhất)
-    if key in EVAL_CACHE:
-        return EVAL_CACHE[key]
+    return results if isinstance(mcq, list) else results[0]
 
+def _evaluate_prompt(question_data: list, context_text: str) -> str:
     prompt = f"""
     Bạn là chuyên gia có kinh nghiệm trong việc đánh giá chất lượng câu hỏi trắc nghiệm (MCQs).
 
@@ -315,59 +700,80 @@ def evaluate_mcq(mcq, context_text: str = "") -> dict:
     **Danh sách câu hỏi:**
     {json.dumps(question_data, ensure_ascii=False, indent=2)}
     """
+    return prompt
+
+def _is_evaluation_item(item) -> bool:
+    return isinstance(item, dict) and isinstance(item.get("scores"), dict)
+
+def _to_evaluation(item: dict) -> dict:
+    scores = item.get("scores", {})
+    return {
+        "score": int(scores.get("total", 0)),
+        "status": item.get("status", "need_review"),
+        "_eval_breakdown": {
+            "accuracy": scores.get("accuracy", 0),
+            "alignment": scores.get("alignment", 0),
+            "distractors": scores.get("distractors", 0),
+            "clarity": scores.get("clarity", 0),
+        },
+    }
+
+def _match_evaluations(text: str, question_data: list) -> list:
+    """
+    Đánh giá cho từng câu của batch (None nếu thiếu). Output đúng định dạng và đủ số câu →
+    ghép theo thứ tự như trước; output hỏng / thiếu câu → cứu các đánh giá còn nguyên vẹn
+    và ghép theo nội dung câu hỏi.
+    """
+    data = parse_json_lenient(text)
+    details = data.get("details") if isinstance(data, dict) else None
+    matched = [None] * len(question_data)
+    if isinstance(details, list) and len(details) == len(question_data) and all(map(_is_evaluation_item, details)):
+        items = list(enumerate(details))
+    else:
+        if not isinstance(details, list):
+            details = salvage_json_objects(text, _is_evaluation_item)
+        keys = [normalize_question_key(q.get("question", "")) if isinstance(q, dict) else "" for q in question_data]
+        items, used = [], set()
+        for item in details:
+            if not _is_evaluation_item(item):
+                continue
+            key = normalize_question_key(item.get("question", ""))
+            for i, k in enumerate(keys):
+                if k and k == key and i not in used:
+                    used.add(i)
+                    items.append((i, item))
+                    break
+    for i, item in items:
+        try:
+            matched[i] = _to_evaluation(item)
+        except (TypeError, ValueError):
+            pass
+    return matched
 
+async def _evaluate_batch(
+    question_data: list, context_text: str, model_name: str, retries: int = LLM_PARSE_RETRIES
+) -> list:
+    """
+    Gọi Gemini chấm một batch câu hỏi. Trả về list cùng độ dài với question_data,
+    mỗi phần tử là dict đánh giá (score/status/_eval_breakdown) hoặc Exception nếu lỗi.
+    Câu nào không có đánh giá đọc được thì chỉ riêng các câu đó được chấm lại.
+    """
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
-        )
-        text = response.text.strip()
-
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.endswith("```"):
-            text = text[:-3]
-        text = text.strip()
-
-        data = json.loads(text)
-        details = data.get("details", [])
-
-        # ✅ Xử lý nhiều câu hỏi
-        results = []
-        for i, item in enumerate(details):
-            base = question_data[i] if i < len(question_data) else {}
-            scores = item.get("scores", {})
-            total = scores.get("total", 0)
-            result = dict(base)
-            result["score"] = int(total)
-            result["status"] = item.get("status", "need_review")
-            result["_eval_breakdown"] = {
-                "accuracy": scores.get("accuracy", 0),
-                "alignment": scores.get("alignment", 0),
-                "distractors": scores.get("distractors", 0),
-                "clarity": scores.get("clarity", 0),
-            }
-            results.append(result)
-
-        final_result = results if isinstance(mcq, list) else results[0]
-        EVAL_CACHE[key] = final_result
-        return final_result
-
+        text = await generate_text(_evaluate_prompt(question_data, context_text), model_name, task="evaluate")
     except Exception as e:
-        # Nếu lỗi → fallback cho từng câu hỏi
+        # Nếu lỗi → fallback cho từng câu hỏi của batch
         print(f"❌ Lỗi khi đánh giá câu hỏi: {e}")
-        def make_fallback(q):
-            fb = dict(q)
-            fb["score"] = 0
-            fb["status"] = "rejected"
-            fb["_eval_breakdown"] = {
-                "accuracy": 0,
-                "alignment": 0,
-                "distractors": 0,
-                "clarity": 0,
-            }
-            fb["comment"] = f"Lỗi khi gọi Gemini: {str(e)}"
-            return fb
-        if isinstance(mcq, list):
-            return [make_fallback(q) for q in mcq]
-        return make_fallback(mcq)
\ No newline at end of file
+        return [e for _ in question_data]
+
+    evaluations = _match_evaluations(text, question_data)
+    missing = [i for i, evaluation in enumerate(evaluations) if evaluation is None]
+    if missing and retries > 0:
+        print(f"⚠️  Thiếu đánh giá cho {len(missing)}/{len(question_data)} câu, chấm lại riêng các câu đó...")
+        LLM_RETRIES.inc(task="evaluate")
+        retried = await _evaluate_batch([question_data[i] for i in missing], context_text, model_name, retries - 1)
+        for i, evaluation in zip(missing, retried):
+            evaluations[i] = evaluation
+    return [
+        evaluation if evaluation is not None else ValueError("Gemini không trả đánh giá cho câu hỏi này.")
+        for evaluation in evaluations
+    ]
@@ -1,19 +1,27 @@
+import hashlib
+import json
 import os
 import re
-from typing import Tuple
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+# Control characters that str.split() does NOT already treat as whitespace
+# (\t \n \v \f \r, \x1c-\x1f and \x85 are whitespace and collapse below).
+_CONTROL_RE = re.compile(r"[\x00-\x08\x0e-\x1b\x7f-\x84\x86-\x9f]")
 
 def clean_text(raw_text: str) -> str:
     """Clean control characters and collapse whitespace.
 
+    One regex sweep for the remaining control characters (no copy at all when
+    there are none) and one split/join; output is identical to the previous
+    sub + replace + split/join chain.
+
     Returns an empty string for falsy input.
     """
     if not raw_text:
         return ""
 
-    text = re.sub(r"[\x00-\x1f\x7f-\x9f]", " ", raw_text)
-    text = text.replace("\r\n", " ").replace("\n", " ").replace("\t", " ")
-    text = " ".join(text.split())
-    return text
+    return " ".join(_CONTROL_RE.sub(" ", raw_text).split())
 
 def check_file_size_bytes(content_bytes: bytes, max_mb: int) -> Tuple[bool, str]:
     """Return (ok, message) whether bytes length <= max_mb.
@@ -25,6 +33,200 @@ def check_file_size_bytes(content_bytes: bytes, max_mb: int) -> Tuple[bool, str]
         return False, f"File quá lớn (> {max_mb}MB)."
     return True, "OK"
 
+async def stream_upload(upload_file, dest, max_mb: int, chunk_size: int = 1024 * 1024) -> Tuple[bool, str]:
+    """Copy an UploadFile into ``dest`` chunk by chunk.
+
+    Stops and returns (False, message) as soon as more than ``max_mb`` has been
+    read, so oversized uploads are never held in memory in full.
+    """
+    max_bytes = max_mb * 1024 * 1024
+    too_large = f"File quá lớn (> {max_mb}MB)."
+    declared = getattr(upload_file, "size", None)
+    if declared is not None and declared > max_bytes:
+        return False, too_large
+
+    total = 0
+    while True:
+        chunk = await upload_file.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            return False, too_large
+        dest.write(chunk)
+    return True, "OK"
+
 def safe_filename(filename: str) -> str:
     """Return basename to avoid directory traversal in uploaded filenames."""
     return os.path.basename(filename)
+
+
+def split_text_into_chunks(text: str, chunk_size: int, overlap: int = 0) -> List[str]:
+    """Split text into overlapping chunks of at most ``chunk_size`` chars.
+
+    Chunk ends are moved back to the nearest sentence end (or space) inside
+    the chunk so questions are not generated from half sentences.
+    """
+    if not text:
+        return []
+    if len(text) <= chunk_size:
+        return [text]
+
+    overlap = max(0, min(overlap, chunk_size // 2))
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            window = text[start:end]
+            cut = max(window.rfind(". "), window.rfind("? "), window.rfind("! "))
+            if cut < chunk_size // 2:
+                cut = window.rfind(" ")
+            if cut >= chunk_size // 2:
+                end = start + cut + 1
+        chunks.append(text[start:end].strip())
+        if end >= length:
+            break
+        start = end - overlap
+        # Bắt đầu chunk tiếp theo ở đầu một từ
+        if text[start - 1] != " ":
+            space = text.find(" ", start, end)
+            if 0 <= space < end - 1:
+                start = space + 1
+    return [c for c in chunks if c]
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+def split_text_content_defined(text: str, chunk_size: int) -> List[str]:
+    """Split text into ~``chunk_size``-char chunks whose boundaries depend on content.
+
+    Cuts fall after sentences chosen by a hash of the sentence itself (once the
+    chunk is at least half of ``chunk_size``), never past ``2 * chunk_size``.
+    Editing one sentence therefore changes only the chunk(s) around it; chunks
+    before and after keep the same text and the same ``chunk_hash``.
+    """
+    if not text:
+        return []
+    min_size = max(1, chunk_size // 2)
+    max_size = chunk_size * 2
+
+    sentences = []
+    for sentence in _SENTENCE_END_RE.split(text):
+        if len(sentence) > max_size:
+            sentences.extend(split_text_into_chunks(sentence, chunk_size))
+        elif sentence:
+            sentences.append(sentence)
+
+    chunks, current, size = [], [], 0
+    for sentence in sentences:
+        if current and size + len(sentence) > max_size:
+            chunks.append(" ".join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += len(sentence) + 1
+        # Cut here with probability ~len/(chunk_size - min_size): mean chunk ≈ chunk_size
+        if size >= min_size and (zlib.crc32(sentence.encode("utf-8")) & 0xFFFF) * (chunk_size - min_size) < len(sentence) * 0x10000:
+            chunks.append(" ".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def chunk_hash(chunk: str) -> str:
+    """Stable id of a chunk's content (whitespace-insensitive)."""
+    return hashlib.sha1(" ".join(chunk.split()).encode("utf-8")).hexdigest()
+
+# Rough Gemini ratio: ~4 UTF-8 bytes per token. Vietnamese letters with
+# diacritics take 2-3 bytes, so they weigh more than ASCII, as in the real tokenizer.
+_BYTES_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token-count estimate (no API call) used to size prompts."""
+    if not text:
+        return 0
+    return -(-len(text.encode("utf-8")) // _BYTES_PER_TOKEN)
+
+def split_text_by_tokens(text: str, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """Like split_text_into_chunks, but every chunk fits in ``max_tokens`` (estimated).
+
+    The char budget is derived from this text's own chars/token ratio, with a
+    10% margin for chunks denser than the average.
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return [text] if text else []
+    chars_per_token = len(text) / tokens
+    chunk_size = max(1, int(max_tokens * chars_per_token * 0.9))
+    overlap = int(overlap_tokens * chars_per_token)
+    return split_text_into_chunks(text, chunk_size, overlap)
+
+def distribute_count(total: int, parts: int) -> List[int]:
+    """Spread ``total`` items as evenly as possible over ``parts`` slots.
+
+    When there are more slots than items, the non-zero slots are spaced out
+    over the whole range instead of being packed at the start.
+    """
+    if parts <= 0:
+        return []
+    return [((i + 1) * total) // parts - (i * total) // parts for i in range(parts)]
+
+def normalize_question_key(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace for duplicate checks."""
+    text = re.sub(r"[^\w\s]", " ", str(question or "").lower())
+    return " ".join(text.split())
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_JSON_DECODER = json.JSONDecoder(strict=False)  # strict=False: allow raw newlines inside strings
+
+def strip_code_fences(text: str) -> str:
+    """Remove a surrounding ```json ... ``` (or bare ```) fence from model output."""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text[3:]
+        if text[:4].lower() == "json":
+            text = text[4:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+def parse_json_lenient(text: str):
+    """Parse model output as JSON after stripping fences; ``None`` if it is not valid JSON."""
+    text = strip_code_fences(text)
+    for candidate in (text, _TRAILING_COMMA_RE.sub(r"\1", text)):
+        try:
+            value, end = _JSON_DECODER.raw_decode(candidate)
+        except ValueError:
+            continue
+        if not candidate[end:].strip():
+            return value
+    return None
+
+def salvage_json_objects(text: str, accept: Callable[[dict], bool]) -> List[dict]:
+    """Recover every well-formed JSON object accepted by ``accept`` from broken output.
+
+    Scans for ``{`` and decodes one object at a time, so a malformed item, a
+    truncated tail or stray prose only loses the objects it touches. Once an
+    object is accepted, the scan resumes after it (nested objects are not
+    returned separately); rejected objects are searched for accepted children.
+    """
+    text = strip_code_fences(text)
+    repaired = _TRAILING_COMMA_RE.sub(r"\1", text)
+    objects = []
+    for source in ((text,) if repaired == text else (text, repaired)):
+        found = []
+        pos = source.find("{")
+        while pos != -1:
+            try:
+                value, end = _JSON_DECODER.raw_decode(source, pos)
+            except ValueError:
+                value, end = None, pos + 1
+            if isinstance(value, dict) and accept(value):
+                found.append(value)
+                pos = source.find("{", end)
+            else:
+                pos = source.find("{", pos + 1)
+        if len(found) > len(objects):
+            objects = found
+    return objects
+
@@ -0,0 +1,141 @@
+"""Benchmark thông lượng pipeline agent, chạy offline với FakeProvider.
+
+Chạy từ thư mục gốc repo:
+    python -m benchmarks.bench_agent [--requests 40] [--concurrency 8] [--questions 10]
+                                     [--mode auto] [--latency-ms 800] [--failure-rate 0] [--malformed-rate 0]
+                                     [--output-words 200] [--text-kb 20] [--seed 0] [--router]
+
+Mỗi request dùng một văn bản khác nhau (sinh tất định từ seed), cache LLM trên đĩa tắt,
+nên mọi bước đều đi qua provider giả với độ trễ / tỉ lệ lỗi cấu hình được.
+--router: gọi POST /agent/text qua ASGI (cần đủ dependency của router, ví dụ mariadb).
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("MAX_FILE_SIZE_MB", "20")
+os.environ.setdefault("JWT_EXPIRE_MINUTES", "60")
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["LLM_CACHE_ENABLED"] = "0"
+
+from app.agent import Agent  # noqa: E402
+from app.llm import FakeProvider, set_provider  # noqa: E402
+from app.metrics import LLM_REQUESTS, LLM_RETRIES  # noqa: E402
+
+WORDS = (
+    "giảng viên sinh viên câu hỏi trắc nghiệm kiến thức hệ thống dữ liệu mô hình bài giảng "
+    "lịch sử địa lý toán học vật lý hóa học sinh học văn học ngôn ngữ lập trình mạng máy tính"
+).split()
+
+def make_text(index: int, size_kb: int, seed: int) -> str:
+    rng = random.Random(f"{seed}:{index}")
+    parts = []
+    size = 0
+    while size < size_kb * 1024:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + ". "
+        parts.append(sentence)
+        size += len(sentence.encode("utf-8"))
+    return "".join(parts)
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+async def run_agent(args, texts):
+    agent = Agent()
+    limiter = asyncio.Semaphore(args.concurrency)
+
+    async def one(text):
+        async with limiter:
+            start = time.perf_counter()
+            try:
+                result = await agent.decide_and_run(text, num_questions=args.questions, summary_mode=args.mode)
+            except Exception as e:
+                return time.perf_counter() - start, None, e
+            return time.perf_counter() - start, len(result.get("questions", []) or []), None
+
+    return await asyncio.gather(*(one(text) for text in texts))
+
+async def run_router(args, texts):
+    import httpx
+    from fastapi import FastAPI
+    from app.routers import agent_router, auth_router
+
+    app = FastAPI()
+    app.include_router(agent_router.router)
+    app.dependency_overrides[auth_router.get_current_user] = lambda: {"user_id": 1}
+    limiter = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def one(index, text):
+            async with limiter:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/agent/text",
+                    files={"file": (f"doc{index}.txt", text.encode("utf-8"), "text/plain")},
+                    data={"num_questions": str(args.questions), "summary_mode": args.mode},
+                    timeout=None,
+                )
+                if response.status_code != 200:
+                    return time.perf_counter() - start, None, response.status_code
+                return time.perf_counter() - start, len(response.json().get("questions", []) or []), None
+
+        return await asyncio.gather(*(one(i, text) for i, text in enumerate(texts)))
+
+def gemini_calls() -> dict:
+    calls = {}
+    for (task, _, outcome), count in LLM_REQUESTS._values.items():
+        calls[f"{task}/{outcome}"] = calls.get(f"{task}/{outcome}", 0) + int(count)
+    return dict(sorted(calls.items()))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--mode", default="auto", choices=["auto", "force", "none", "chunked"])
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Tỉ lệ output JSON bị cắt cụt")
+    parser.add_argument("--output-words", type=int, default=200)
+    parser.add_argument("--text-kb", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--router", action="store_true", help="Đo qua POST /agent/text thay vì gọi Agent trực tiếp")
+    args = parser.parse_args()
+
+    set_provider(FakeProvider(
+        latency_ms=args.latency_ms,
+        failure_rate=args.failure_rate,
+        output_words=args.output_words,
+        seed=args.seed,
+        malformed_rate=args.malformed_rate,
+    ))
+    texts = [make_text(i, args.text_kb, args.seed) for i in range(args.requests)]
+
+    runner = run_router if args.router else run_agent
+    start = time.perf_counter()
+    results = asyncio.run(runner(args, texts))
+    elapsed = time.perf_counter() - start
+
+    latencies = [r[0] for r in results]
+    questions = [r[1] for r in results if r[2] is None]
+    failed = [r[2] for r in results if r[2] is not None]
+    target = "POST /agent/text" if args.router else "Agent.decide_and_run"
+    print(f"{target}: {args.requests} request, concurrency {args.concurrency}, mode={args.mode}, "
+          f"{args.questions} câu/request, văn bản {args.text_kb} KB, latency giả {args.latency_ms:.0f} ms")
+    print(f"  tổng thời gian   {elapsed:8.2f} s")
+    print(f"  thông lượng      {args.requests / elapsed:8.2f} request/s")
+    print(f"  latency p50      {statistics.median(latencies):8.2f} s")
+    print(f"  latency p95      {percentile(latencies, 0.95):8.2f} s")
+    print(f"  latency max      {max(latencies):8.2f} s")
+    print(f"  request lỗi      {len(failed):8d}" + (f"   (vd: {failed[0]})" if failed else ""))
+    if questions:
+        print(f"  câu hỏi/request  {statistics.mean(questions):8.2f}")
+    print(f"  gọi LLM          {gemini_calls()}")
+    print(f"  gọi lại (JSON)   {dict((task, int(n)) for (task,), n in sorted(LLM_RETRIES._values.items()))}")
+
+if __name__ == "__main__":
+    main()
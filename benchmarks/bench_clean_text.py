@@ -0,0 +1,55 @@
+"""Benchmark app.utils.clean_text so với bản cũ (legacy_clean_text).
+
+Chạy từ thư mục gốc repo:
+    python -m benchmarks.bench_clean_text [--sizes 1 10 50] [--repeat 3]
+
+Tính tương đương từng byte với bản cũ được kiểm tra trong tests/test_utils.py;
+script này chỉ đo thời gian (và vẫn so kết quả trên chính các input dùng để đo).
+"""
+import argparse
+import random
+import time
+
+from app.utils import clean_text
+from tests.test_utils import legacy_clean_text
+
+def make_input(size_mb: int, seed: int = 1) -> str:
+    """Văn bản giống text trích từ PDF: phần lớn là chữ, xen xuống dòng/tab/ký tự rác."""
+    rng = random.Random(seed)
+    line = "Hệ thống sinh câu hỏi trắc nghiệm giúp giảng viên tạo đề nhanh và tiết kiệm thời gian. "
+    noise = ["\n", "\r\n", "\t", "  ", "\x0c", "\x00 ", "\xa0"]
+    parts = []
+    size = 0
+    target = size_mb * 1024 * 1024
+    while size < target:
+        part = line * rng.randint(1, 4) + rng.choice(noise)
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)
+
+def timed(func, text: str, repeat: int):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50], help="Kích thước input (MB)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'input':>8} {'legacy':>12} {'new':>12} {'speedup':>8}")
+    for size_mb in args.sizes:
+        text = make_input(size_mb)
+        legacy_s, legacy_out = timed(legacy_clean_text, text, args.repeat)
+        new_s, new_out = timed(clean_text, text, args.repeat)
+        assert new_out == legacy_out, f"Kết quả khác nhau với input {size_mb} MB"
+        print(f"{size_mb:>6} MB {legacy_s * 1000:>9.1f} ms {new_s * 1000:>9.1f} ms {legacy_s / new_s:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Benchmark trích xuất text từ file upload.
+
+Chạy từ thư mục gốc repo:
+    python -m benchmarks.bench_extraction [--pages 500] [--docx-paragraphs 5000] [--repeat 3]
+
+Sinh PDF mẫu 500 trang trong RAM rồi so sánh:
+- legacy: ghi file tạm + `text += page.get_text()` (cách cũ),
+- serial: mở PDF từ bytes, join một lần,
+- parallel: chia dải trang trên process pool.
+
+Sinh DOCX mẫu (paragraph + bảng) và so sánh đường cũ (file tạm, chỉ paragraph)
+với đường mới (BytesIO, paragraph + ô bảng). Mọi kết quả đều in kèm ms/MB.
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+os.environ.setdefault("MAX_FILE_SIZE_MB", "20")
+os.environ.setdefault("JWT_EXPIRE_MINUTES", "60")
+
+import fitz  # noqa: E402
+from docx import Document  # noqa: E402
+from app import tools  # noqa: E402
+
+LOREM = (
+    "Multiple-choice questions are generated from the extracted text of each page. "
+    "This sentence is repeated to give every page a realistic amount of content. "
+)
+
+def make_sample_pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        body = f"Page {i + 1}\n" + (LOREM * 12)
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), body, fontsize=10)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def legacy_extract_pdf(content: bytes) -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+        tmp.write(content)
+        tmp_path = tmp.name
+    text = ""
+    try:
+        with fitz.open(tmp_path) as pdf:
+            for page in pdf:
+                text += page.get_text()
+    finally:
+        os.remove(tmp_path)
+    return text
+
+def make_sample_docx(paragraphs: int) -> bytes:
+    doc = Document()
+    for i in range(1, paragraphs + 1):
+        doc.add_paragraph(f"Section {i}. " + LOREM * 3)
+        if i % 10 == 0:
+            table = doc.add_table(rows=3, cols=3)
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    cell.text = f"Cell {i}-{r}-{c}: " + LOREM
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+def legacy_extract_docx(content: bytes) -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
+        tmp.write(content)
+        tmp_path = tmp.name
+    try:
+        doc = Document(tmp_path)
+        return "\n".join([p.text for p in doc.paragraphs])
+    finally:
+        os.remove(tmp_path)
+
+def timed(func, content: bytes, repeat: int):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def report(label: str, seconds: float, size_bytes: int):
+    mb = size_bytes / (1024 * 1024)
+    print(f"{label:<28} {seconds * 1000:9.1f} ms   {seconds / mb * 1000:8.1f} ms/MB")
+
+def bench_pdf(pages: int, repeat: int):
+    content = make_sample_pdf(pages)
+    print(f"PDF mẫu: {pages} trang, {len(content) / (1024 * 1024):.2f} MB")
+
+    legacy_s, legacy_text = timed(legacy_extract_pdf, content, repeat)
+    report("pdf legacy (temp file, +=)", legacy_s, len(content))
+
+    threshold = tools.PDF_PARALLEL_PAGE_THRESHOLD
+    tools.PDF_PARALLEL_PAGE_THRESHOLD = pages + 1
+    serial_s, serial_text = timed(tools.extract_text_from_pdf_bytes, content, repeat)
+    report("pdf in-memory (serial)", serial_s, len(content))
+
+    tools.PDF_PARALLEL_PAGE_THRESHOLD = 1
+    tools.extract_text_from_pdf_bytes(content)  # khởi động process pool trước khi đo
+    parallel_s, parallel_text = timed(tools.extract_text_from_pdf_bytes, content, repeat)
+    report(f"pdf parallel ({tools.PDF_EXTRACT_WORKERS} workers)", parallel_s, len(content))
+    tools.PDF_PARALLEL_PAGE_THRESHOLD = threshold
+
+    assert legacy_text == serial_text == parallel_text, "Kết quả trích xuất không khớp"
+
+def bench_docx(paragraphs: int, repeat: int):
+    content = make_sample_docx(paragraphs)
+    print(f"DOCX mẫu: {paragraphs} paragraph, {len(content) / (1024 * 1024):.2f} MB")
+
+    legacy_s, legacy_text = timed(legacy_extract_docx, content, repeat)
+    report("docx legacy (temp file)", legacy_s, len(content))
+
+    new_s, new_text = timed(tools.extract_text_from_docx_bytes, content, repeat)
+    report("docx in-memory (+tables)", new_s, len(content))
+    print(f"{'':<28} text: {len(legacy_text):,} → {len(new_text):,} ký tự (thêm nội dung bảng)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--docx-paragraphs", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    bench_pdf(args.pages, args.repeat)
+    print()
+    bench_docx(args.docx_paragraphs, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+-- Incremental re-upload: content hash của từng chunk văn bản trong mỗi file.
+-- Câu hỏi sinh từ một chunk mang "_chunk_hash" trong QuestionEvaluations.raw_response_json;
+-- khi file được upload lại, chunk có hash trùng thì dùng lại câu hỏi, không gọi Gemini.
+
+CREATE TABLE IF NOT EXISTS `FileChunks` (
+  `file_id` int(11) NOT NULL,
+  `chunk_index` int(11) NOT NULL,
+  `chunk_hash` char(40) NOT NULL,
+  PRIMARY KEY (`file_id`, `chunk_index`),
+  KEY `file_chunk_hash` (`file_id`, `chunk_hash`),
+  CONSTRAINT `FileChunks_ibfk_1` FOREIGN KEY (`file_id`) REFERENCES `Files` (`file_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_vietnamese_ci;
@@ -0,0 +1,12 @@
+-- GET /questions phân trang theo keyset (created_at, question_id) trong phạm vi một user:
+-- index phủ đúng thứ tự sắp xếp nên trang 500 chỉ đọc page_size dòng như trang 1.
+-- created_at phải NOT NULL để so sánh keyset không bỏ sót dòng.
+
+UPDATE `Questions` SET `created_at` = COALESCE(`updated_at`, NOW()) WHERE `created_at` IS NULL;
+
+ALTER TABLE `Questions`
+  MODIFY `created_at` datetime NOT NULL DEFAULT current_timestamp(),
+  ADD KEY `creator_created` (`creator_id`, `created_at`, `question_id`),
+  ADD KEY `creator_file_created` (`creator_id`, `source_file_id`, `created_at`, `question_id`),
+  -- `creator_created` đã bắt đầu bằng creator_id (đủ cho FK Questions_ibfk_2)
+  DROP KEY `creator_id`;
@@ -0,0 +1,38 @@
+"""app.utils.clean_text phải cho kết quả giống hệt bản cũ (legacy_clean_text) từng byte."""
+import random
+import re
+import sys
+
+from app.utils import clean_text
+
+def legacy_clean_text(raw_text: str) -> str:
+    """Bản clean_text cũ (5 lần copy toàn bộ chuỗi), giữ lại để so sánh."""
+    if not raw_text:
+        return ""
+
+    text = re.sub(r"[\x00-\x1f\x7f-\x9f]", " ", raw_text)
+    text = text.replace("\r\n", " ").replace("\n", " ").replace("\t", " ")
+    text = " ".join(text.split())
+    return text
+
+PIECES = [
+    "Hệ thống", "sinh", "câu hỏi", "trắc nghiệm", "MCQ", "giảng viên.", "(PDF)",
+    " ", " ", " ", "  ", "\n", "\r\n", "\t", "\x0b", "\x0c", "\x00", "\x07", "\x1f",
+    "\x7f", "\x85", "\x9f", "\xa0", " ", "　", "​",
+]
+
+def test_clean_text_matches_legacy_for_every_code_point():
+    for code in range(sys.maxunicode + 1):
+        ch = chr(code)
+        for text in (ch, f"a{ch}b", f" {ch} "):
+            assert clean_text(text) == legacy_clean_text(text), f"Khác kết quả với U+{code:04X}"
+
+def test_clean_text_matches_legacy_on_random_strings():
+    rng = random.Random(0)
+    for _ in range(20000):
+        text = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 40)))
+        assert clean_text(text) == legacy_clean_text(text), repr(text)
+
+def test_clean_text_empty_input():
+    assert clean_text("") == ""
+    assert clean_text(None) == ""